@@ -1,56 +1,87 @@
 from typing import Callable, List
-from pandas import DataFrame
-from numpy import float64, logical_xor, mean, ndarray, sqrt, std, sum, uint8, zeros
+from operator import attrgetter
+from pandas import DataFrame, Index
+from numpy import add, append, arange, array, bitwise_xor, concatenate, cumsum, float64, floor, int64, maximum, \
+    ndarray, searchsorted, uint8, uint64, unique, unpackbits, zeros
+from CanFrames import CanFrames
 from PipelineTimer import PipelineTimer
+from TangAccumulator import TangAccumulator
 
 
 # noinspection PyArgumentList
 class ArbID:
+    # Slots instead of a per instance __dict__ keep thousands of ArbIDs small in memory and in pickles.
+    __slots__ = ('id', 'dlc', 'original_data', 'boolean_matrix', 'tang', 'tang_accumulator', 'static', 'ci_sensitivity',
+                 'freq_mean', 'freq_std', 'freq_ci', 'mean_to_ci_ratio', 'synchronous', 'freq_percentiles',
+                 'freq_jitter', 'missed_periods', 'bandwidth', 'bus_load', 'tokenization', 'padding')
+    # Scalar metadata columns returned by metadata_table.
+    metadata_fields = ('dlc', 'static', 'ci_sensitivity', 'freq_mean', 'freq_std', 'mean_to_ci_ratio',
+                       'synchronous', 'freq_jitter', 'missed_periods', 'bandwidth', 'bus_load')
+
     def __init__(self, arb_id: int):
         self.id:                int = arb_id
         # These features are set by PreProcessing.py's generate_arb_id_dictionary
         self.dlc:               int = 0
-        self.original_data:     DataFrame = None
+        self.original_data:     CanFrames = None
         # These features are set in generate_binary_matrix_and_tang called by generate_arb_id_dictionary
+        # boolean_matrix stays None if the Arb ID was generated with pack_bits. See extract_bits.
         self.boolean_matrix:    ndarray = None
         self.tang:              ndarray = None
+        self.tang_accumulator:  TangAccumulator = None
         self.static:            bool = True
-        # These features are set in analyze_transmission_frequency called by generate_arb_id_dictionary
+        # These features are set in TimingAnalysis.py's analyze_bus_timing called by generate_arb_id_dictionary
         self.ci_sensitivity:    float = 0.0
         self.freq_mean:         float = 0.0
         self.freq_std:          float = 0.0
         self.freq_ci:           tuple = None
         self.mean_to_ci_ratio:  float = 0.0
         self.synchronous:       bool = False
+        self.freq_percentiles:  dict = {}
+        self.freq_jitter:       float = 0.0
+        self.missed_periods:    int = 0
+        self.bandwidth:         float = 0.0
+        self.bus_load:          float = 0.0
         # These features are set by LexicalAnalysis.py's get_composition
         self.tokenization:      List[tuple] = []
         self.padding:           List[int] = []
 
-    def generate_binary_matrix_and_tang(self, a_timer: PipelineTimer, normalize_strategy: Callable):
+    @staticmethod
+    def metadata_table(id_dictionary: dict, fields: tuple = None) -> DataFrame:
+        # Return a DataFrame with one row per Arb ID and one column per metadata field (metadata_fields by default) for
+        # vectorized access across Arb IDs, e.g. metadata_table(id_dict)['freq_mean'].
+        fields = fields or ArbID.metadata_fields
+        get_fields = attrgetter(*fields)
+        return DataFrame([get_fields(arb_id) for arb_id in id_dictionary.values()], columns=list(fields),
+                         index=Index(list(id_dictionary.keys()), name='arb_id'))
+
+    def generate_binary_matrix_and_tang(self,
+                                        a_timer:            PipelineTimer,
+                                        normalize_strategy: Callable,
+                                        tang_accumulator:   TangAccumulator = None,
+                                        pack_bits:          bool = False):
         a_timer.start_nested_function_time()
 
-        self.boolean_matrix = zeros((self.original_data.__len__(), self.dlc * 8), dtype=uint8)
-
-        for i, row in enumerate(self.original_data.itertuples()):
-            for j, cell in enumerate(row[1:]):
-                # Skip cells that were already 0
-                if cell > 0:
-                    # i is the row in the boolean_matrix
-                    # j*8 is the left hand bit for this byte in the payload
-                    # j*8 + 8 is the right hand bit for this byte in the payload
-                    # e.g. byte index 1 starts at bits 1*8 = 8 to 1*8+8 = 16; [8:16]
-                    # likewise, byte index 7 starts at bits 7*8 = 56 to 7*8+8 = 64
-                    # Numpy indexing is non-inclusive of the upper bound. So [0:8] is the first 7 elements
-                    bin_string = format(cell, '08b')
-                    self.boolean_matrix[i, j * 8:j * 8 + 8] = [x == '1' for x in bin_string]
+        # Unpack every payload byte into its 8 bits, most significant bit first, so bit 0 of the boolean matrix is the
+        # left hand bit of b0. e.g. byte index 1 maps to bits 1*8 = 8 to 1*8+8 = 16; [8:16]. Only the first DLC bytes
+        # were actually on the bus.
+        # With pack_bits the boolean matrix is never built. The payload bytes already hold the same bits packed 8 per
+        # byte, which is an eighth of the memory and of the pickled Arb ID dictionary.
+        payload = self.original_data.payload[:, :self.dlc]
+        self.boolean_matrix = None if pack_bits else unpackbits(payload, axis=1)
 
         a_timer.set_hex_to_bool_matrix()
 
-        if self.boolean_matrix.shape[0] > 1:
+        if payload.shape[0] > 1:
             a_timer.start_nested_function_time()
 
-            transition_matrix = logical_xor(self.boolean_matrix[:-1, ], self.boolean_matrix[1:, ])
-            self.tang = sum(transition_matrix, axis=0, dtype=float64)
+            if tang_accumulator is None:
+                tang_accumulator = TangAccumulator(self.dlc)
+                tang_accumulator.update(self.original_data)
+            # Otherwise the transitions were already counted while the log was streamed in (see ArbIDAccumulator.py).
+            # The accumulator is kept so TANGs from later captures of this Arb ID can be merged in without reprocessing
+            # this one.
+            self.tang_accumulator = tang_accumulator
+            self.tang = tang_accumulator.transition_counts.copy()
             # Ensure there is no divide by zero issues
             if max(self.tang) > 0:
                 normalize_strategy(self.tang, axis=0, copy=False)
@@ -58,32 +89,72 @@ class ArbID:
 
             a_timer.set_bool_matrix_to_tang()
 
-    def analyze_transmission_frequency(self,
-                                       time_convert:            int = 1000,
-                                       ci_accuracy:             float = 1.645,
-                                       synchronous_threshold:   float = 0.1):
-        # Don't bother doing this if there isn't enough data. You would need to handle a bunch of edge cases anyways.
-        if self.original_data.__len__() < 4:
-            return
-
-        self.ci_sensitivity = ci_accuracy
-        # time_convert = 1000 is intended to convert seconds to milliseconds.
-        freq_intervals = self.original_data.index[1:] - self.original_data.index[:-1]
-        self.freq_mean = mean(freq_intervals) * time_convert
-        self.freq_std = std(freq_intervals, ddof=1)*time_convert
-        # Assumes distribution of freq_intervals is gaussian normal.
-        mean_offset = ci_accuracy * self.freq_std / sqrt(len(freq_intervals))
-        self.freq_ci = (self.freq_mean - mean_offset, self.freq_mean + mean_offset)
-        # mean_to_ci_ratio is the ratio of the CI range to the mean value. This is to provide heuristic to determine
-        # if this Arb ID can be called 'synchronous' given the time scale of its average transmission frequency.
-        # For example, imagine an Arb ID transmitting with a mean frequency of exactly one second. Its 90% Confidence
-        # Interval spans 50 milliseconds about that ideal mean. It's reasonable to assume this Arb ID was engineered to
-        # be a 'synchronous' signal. However, a different Arb ID with a mean frequency of 40 milliseconds and the same
-        # confidence interval could not be reasonably assumed to have been engineered to be 'synchronous'. This other
-        # Arb ID was engineered to be 'high frequency' compared to the first example, but there isn't evidence that it's
-        # intended to be a high frequency 'synchronous' process that adheres to a certain clock frequency.
-        # This inference relies upon the assumption that the OEM didn't engineer the bus to be a train wreck with some
-        # IDs losing an arbitrarily large percentage of their arbitration phases.
-        self.mean_to_ci_ratio = 2*mean_offset/self.freq_mean
-        if self.mean_to_ci_ratio <= synchronous_threshold:
-            self.synchronous = True
+    def extract_tokens(self, tokens: List[tuple]) -> ndarray:
+        # Return one column of unsigned integers per (start, stop) token, bits start through stop inclusive and indexed
+        # like the boolean matrix. Each payload is read once as a big endian 64 bit word, then every token is a shift
+        # and a mask of those words. This works for Arb IDs generated with pack_bits and for tokens up to 64 bits wide.
+        padded = zeros((self.original_data.__len__(), 8), dtype=uint8)
+        padded[:, :self.dlc] = self.original_data.payload[:, :self.dlc]
+        words = padded.view('>u8')[:, 0].astype(uint64)
+        starts, stops = array(tokens, dtype=int64).reshape(-1, 2).T
+        shifts = (63 - stops).astype(uint64)
+        masks = ~uint64(0) >> (64 - (stops - starts + 1)).astype(uint64)
+        return (words.reshape(-1, 1) >> shifts) & masks
+
+    def extract_bits(self, start: int, stop: int) -> ndarray:
+        # Return bits start through stop (inclusive) of every payload as unsigned integers. See extract_tokens.
+        return self.extract_tokens([(start, stop)])[:, 0]
+
+    def windowed_tang(self,
+                      window:               float,
+                      by_time:              bool = True,
+                      normalize_strategy:   Callable = None,
+                      block_rows:           int = 1 << 16) -> (ndarray, ndarray):
+        # Return the start time of each window and a windows x bits matrix with one TANG per window. Windows are window
+        # seconds long starting at the first frame, or window frames long if by_time is False. Only transitions between
+        # frames in the same window are counted, so each row matches the TANG of that window's frames on their own.
+        # Rows are transition frequencies (transitions / consecutive frame pairs in the window) unless a
+        # normalize_strategy (e.g. minmax_scale) is given, which is applied to each row instead.
+        time = self.original_data.time
+        payload = self.original_data.payload[:, :self.dlc]
+        n = payload.shape[0]
+        if n == 0:
+            return zeros(0, dtype=float64), zeros((0, self.dlc * 8), dtype=float64)
+        if by_time:
+            starts = time[0] + window * arange(int(floor((time[-1] - time[0]) / window)) + 1)
+            edges = append(searchsorted(time, starts, side='left'), n)
+        else:
+            edges = append(arange(0, n, int(window)), n)
+            starts = time[edges[:-1]]
+        first = edges[:-1]
+        last = maximum(edges[1:] - 1, first)
+
+        # A window's TANG is the transitions counted up to its last frame less those counted up to its first frame.
+        cumulative = self.cumulative_transitions(concatenate((first, last)), block_rows)
+        tangs = (cumulative[first.shape[0]:] - cumulative[:first.shape[0]]).astype(float64)
+
+        if normalize_strategy is None:
+            tangs /= maximum(last - first, 1).reshape(-1, 1)
+        else:
+            normalize_strategy(tangs, axis=1, copy=False)
+        return starts, tangs
+
+    def cumulative_transitions(self, rows: ndarray, block_rows: int = 1 << 16) -> ndarray:
+        # Return a rows x bits matrix where row k is the number of transitions of each bit between frames 0 through
+        # rows[k]. The TANG of frames first through last is then cumulative[last] - cumulative[first], so any number of
+        # contiguous TANGs cost one pass over the payloads. Only the requested rows are kept, so the XORed payloads are
+        # summed (unpacked block_rows frames at a time to keep memory bounded) between consecutive requested rows and
+        # only those segment sums are accumulated.
+        payload = self.original_data.payload[:, :self.dlc]
+        n = payload.shape[0]
+        wanted = unique(append(0, rows))
+        segment_sums = zeros((wanted.shape[0], self.dlc * 8), dtype=int64)
+        for i in range(0, n - 1, block_rows):
+            j = min(i + block_rows, n - 1)
+            transitions = unpackbits(bitwise_xor(payload[i:j], payload[i + 1:j + 1]), axis=1)
+            lo, hi = searchsorted(wanted, [i + 1, j])
+            cuts = append(i, wanted[lo:hi])
+            segment_sums[searchsorted(wanted, cuts, side='right') - 1] += add.reduceat(transitions, cuts - i, axis=0,
+                                                                                        dtype=int64)
+        cumulative = cumsum(segment_sums, axis=0) - segment_sums
+        return cumulative[searchsorted(wanted, rows)]
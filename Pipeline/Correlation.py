@@ -0,0 +1,214 @@
+from numpy import absolute as absolute_value, arange, clip, concatenate, empty, errstate, flatnonzero, float32, \
+    float64, int32, isnan, ix_, lexsort, matmul, maximum, memmap, minimum, nan, ndarray, nonzero, ones, sqrt, triu, \
+    where, zeros
+from pandas import concat, DataFrame
+
+# Number of signals per block of the blocked correlation. Only two blocks of standardized values and one block by block
+# piece of the result are worked on at a time.
+correlation_block_size: int = 2048
+
+
+def standardize(values: ndarray, block_size: int = correlation_block_size) -> ndarray:
+    # Return values centered and scaled so each column has unit length, as a column major float32 matrix. The Pearson
+    # correlation of two columns is then just their dot product. Each block of columns is centered in float64, so a
+    # large offset doesn't cost precision, and only one block is float64 at a time. Constant columns have no
+    # correlation with anything and come back as NaN, the same as DataFrame.corr gives them.
+    standardized = empty(values.shape, dtype=float32, order='F')
+    for first in range(0, values.shape[1], block_size):
+        block = values[:, first:first + block_size].astype(float64)
+        constant = block.max(axis=0) == block.min(axis=0)
+        block -= block.mean(axis=0)
+        with errstate(divide='ignore', invalid='ignore'):
+            block /= sqrt((block * block).sum(axis=0))
+        block[:, constant] = nan
+        standardized[:, first:first + block_size] = block
+    return standardized
+
+
+def correlation_blocks(standardized: ndarray, block_size: int = correlation_block_size):
+    # Yield (first, second, block) for each block of the upper triangle of the correlation matrix of a standardized
+    # matrix, where block is the correlation of columns first onward with columns second onward (block_size columns
+    # each). The blocks are found by BLAS matrix multiplies, one pair of column blocks at a time.
+    n = standardized.shape[1]
+    for first in range(0, n, block_size):
+        rows = standardized[:, first:first + block_size]
+        for second in range(first, n, block_size):
+            block = matmul(rows.T, standardized[:, second:second + block_size])
+            if first == second:
+                # Rounding can leave a diagonal block slightly asymmetric. Mirror its upper triangle.
+                block = triu(block) + triu(block, 1).T
+            yield first, second, block
+
+
+def pearson_correlation(df: DataFrame,
+                        block_size:         int = correlation_block_size,
+                        memmap_filename:    str = '') -> DataFrame:
+    # Return the Pearson correlation matrix of the columns of df as a float32 DataFrame labeled like df.corr(). Only the
+    # upper triangle of blocks is computed (see correlation_blocks). If memmap_filename is given the result is written
+    # block by block to a numpy memmap in that file instead of memory; use this for tens of thousands of signals where
+    # the n x n result won't fit in memory.
+    values = df.values
+    if isnan(values).any():
+        # NaN means some pairs of columns have fewer observations in common than others. DataFrame.corr handles that
+        # by correlating each pair over just their complete observations. Aligned signals never have NaN.
+        return df.corr().astype(float32)
+
+    standardized = standardize(values, block_size)
+    n = standardized.shape[1]
+    if memmap_filename:
+        result = memmap(memmap_filename, dtype=float32, mode='w+', shape=(n, n))
+    else:
+        result = empty((n, n), dtype=float32)
+    for first, second, block in correlation_blocks(standardized, block_size):
+        result[first:first + block.shape[0], second:second + block.shape[1]] = block
+        result[second:second + block.shape[1], first:first + block.shape[0]] = block.T
+    # Rounding can also push a coefficient just past +/- 1. Every column correlates perfectly with itself, unless it's
+    # constant.
+    clip(result, -1.0, 1.0, out=result)
+    diagonal = arange(n)
+    result[diagonal, diagonal] = where(isnan(result[diagonal, diagonal]), nan, 1.0)
+    return DataFrame(result, index=df.columns.copy(), columns=df.columns.copy(), copy=False)
+
+
+class CorrelationGraph:
+    # The pairs of signals whose correlation clears a threshold, as an edge list. Vertices are signal_ids positions and
+    # each pair is stored once, with rows[i] < cols[i], sorted by row then col. Memory scales with the number of strong
+    # relationships instead of the square of the number of signals, and the graph pickles as a few flat arrays.
+    def __init__(self, signal_ids: ndarray, rows: ndarray, cols: ndarray, coefficients: ndarray):
+        self.signal_ids:    ndarray = signal_ids        # one signal ID per vertex, like a correlation matrix's columns
+        self.rows:          ndarray = rows              # int32
+        self.cols:          ndarray = cols              # int32
+        self.coefficients:  ndarray = coefficients      # float32 Pearson correlation of each pair
+
+    def __len__(self) -> int:
+        return self.coefficients.shape[0]
+
+
+def correlation_graph(df: DataFrame,
+                      min_coefficient:  float,
+                      block_size:       int = correlation_block_size,
+                      absolute:         bool = False) -> CorrelationGraph:
+    # Return a CorrelationGraph of the pairs of columns of df whose Pearson correlation is at least min_coefficient (or
+    # whose absolute correlation is, if absolute is True). Correlations are computed one block at a time like
+    # pearson_correlation and only the edges of each block are kept, so the dense matrix never exists.
+    signal_ids = df.columns.values
+    values = df.values
+    if isnan(values).any():
+        # See pearson_correlation. The pairwise complete correlation of frames with NaN is computed densely.
+        blocks = [(0, 0, pearson_correlation(df).values)]
+    else:
+        blocks = correlation_blocks(standardize(values, block_size), block_size)
+
+    rows, cols, coefficients = [], [], []
+    for first, second, block in blocks:
+        kept = (absolute_value(block) if absolute else block) >= min_coefficient
+        if first == second:
+            # Keep each pair once and skip the diagonal.
+            kept &= triu(ones(kept.shape, dtype=bool), 1)
+        block_rows, block_cols = nonzero(kept)
+        rows.append((block_rows + first).astype(int32))
+        cols.append((block_cols + second).astype(int32))
+        coefficients.append(clip(block[block_rows, block_cols], -1.0, 1.0).astype(float32))
+    if not rows:
+        return CorrelationGraph(signal_ids, zeros(0, dtype=int32), zeros(0, dtype=int32), zeros(0, dtype=float32))
+    rows, cols, coefficients = concatenate(rows), concatenate(cols), concatenate(coefficients)
+    order = lexsort((cols, rows))
+    return CorrelationGraph(signal_ids, rows[order], cols[order], coefficients[order])
+
+
+def dense_correlation_graph(corr_matrix:      DataFrame,
+                            min_coefficient:  float,
+                            block_size:       int = correlation_block_size) -> CorrelationGraph:
+    # Return a CorrelationGraph of the pairs of a dense correlation matrix, such as pearson_correlation's, with
+    # correlation of at least min_coefficient. The matrix is read block_size rows at a time, so a memmapped matrix is
+    # never loaded into memory whole. NaN coefficients are never kept.
+    signal_ids = corr_matrix.columns.values
+    values = corr_matrix.values
+    n = values.shape[0]
+    rows, cols, coefficients = [], [], []
+    for first in range(0, n, block_size):
+        # Only the upper triangle right of the diagonal, so each pair is kept once.
+        block = values[first:first + block_size, first:]
+        kept = block >= min_coefficient
+        kept &= triu(ones(kept.shape, dtype=bool), 1)
+        block_rows, block_cols = nonzero(kept)
+        rows.append((block_rows + first).astype(int32))
+        cols.append((block_cols + first).astype(int32))
+        coefficients.append(clip(block[block_rows, block_cols], -1.0, 1.0).astype(float32))
+    if not rows:
+        return CorrelationGraph(signal_ids, zeros(0, dtype=int32), zeros(0, dtype=int32), zeros(0, dtype=float32))
+    # Row blocks are in order and nonzero is row major, so the pairs are already sorted by row then col.
+    return CorrelationGraph(signal_ids, concatenate(rows), concatenate(cols), concatenate(coefficients))
+
+
+def cross_correlation(df_a: DataFrame, df_b: DataFrame, block_size: int = correlation_block_size) -> DataFrame:
+    # Return the float32 Pearson correlation of every column of df_a with every column of df_b, which share an index.
+    # This is the df_a rows and df_b columns of pearson_correlation(concat([df_a, df_b], axis=1)) without the df_a x
+    # df_a and df_b x df_b blocks.
+    if isnan(df_a.values).any() or isnan(df_b.values).any():
+        combined = concat([df_a, df_b], axis=1)
+        return combined.corr().astype(float32).iloc[:df_a.shape[1], df_a.shape[1]:]
+    result = matmul(standardize(df_a.values, block_size).T, standardize(df_b.values, block_size))
+    clip(result, -1.0, 1.0, out=result)
+    return DataFrame(result, index=df_a.columns.copy(), columns=df_b.columns.copy(), copy=False)
+
+
+def reachable_correlation_graph(df: DataFrame,
+                                sources:            ndarray,
+                                min_coefficient:    float,
+                                known:              ndarray = None,
+                                block_size:         int = correlation_block_size) -> CorrelationGraph:
+    # Return a CorrelationGraph of the pairs of columns of df, with correlation at least min_coefficient, that can be
+    # reached from the sources columns (a boolean per column) through such pairs. Correlations are found one wave at a
+    # time: the columns reached by the last wave are correlated with every column not reached yet and with each other.
+    # Columns that can't be reached are never correlated with each other. Pairs of two sources and pairs of two known
+    # columns (the caller already knows their correlations) are skipped.
+    signal_ids = df.columns.values
+    values = df.values
+    if isnan(values).any():
+        # See pearson_correlation. The pairwise complete correlation of frames with NaN is computed densely.
+        dense = pearson_correlation(df).values
+        standardized = None
+    else:
+        dense = None
+        standardized = standardize(values, block_size)
+    if known is None:
+        known = zeros(signal_ids.shape[0], dtype=bool)
+
+    visited = sources.copy()
+    frontier = flatnonzero(sources)
+    in_frontier = zeros(signal_ids.shape[0], dtype=bool)
+    first_wave = True
+    rows, cols, coefficients = [], [], []
+    while frontier.size:
+        in_frontier[:] = False
+        in_frontier[frontier] = True
+        # The sources' pairs with each other are skipped, so the first wave only looks at unreached columns.
+        targets = flatnonzero(~visited) if first_wave else flatnonzero(in_frontier | ~visited)
+        reached = zeros(signal_ids.shape[0], dtype=bool)
+        for first in range(0, frontier.size, block_size):
+            block_rows = frontier[first:first + block_size]
+            for second in range(0, targets.size, block_size):
+                block_cols = targets[second:second + block_size]
+                if dense is None:
+                    block = matmul(standardized[:, block_rows].T, standardized[:, block_cols])
+                else:
+                    block = dense[ix_(block_rows, block_cols)]
+                i, j = nonzero(block >= min_coefficient)
+                row, col = block_rows[i], block_cols[j]
+                # Keep each pair of frontier columns once.
+                kept = ~(in_frontier[col] & (col <= row)) & ~(sources[row] & sources[col]) & \
+                    ~(known[row] & known[col])
+                reached[col[kept]] = True
+                rows.append(minimum(row[kept], col[kept]).astype(int32))
+                cols.append(maximum(row[kept], col[kept]).astype(int32))
+                coefficients.append(clip(block[i[kept], j[kept]], -1.0, 1.0).astype(float32))
+        frontier = flatnonzero(reached & ~visited)
+        visited |= reached
+        first_wave = False
+
+    if not rows:
+        return CorrelationGraph(signal_ids, zeros(0, dtype=int32), zeros(0, dtype=int32), zeros(0, dtype=float32))
+    rows, cols, coefficients = concatenate(rows), concatenate(cols), concatenate(coefficients)
+    order = lexsort((cols, rows))
+    return CorrelationGraph(signal_ids, rows[order], cols[order], coefficients[order])
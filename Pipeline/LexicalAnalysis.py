@@ -1,10 +1,12 @@
-from numpy import float64, nditer, uint64, zeros
-from pandas import Series
+from numpy import absolute, append, array, asarray, atleast_2d, broadcast_to, concatenate, diff, flatnonzero, \
+    float64, full, int64, ndarray, ones, zeros
 from os import path, remove
 from pickle import load
 from ArbID import ArbID
-from Signal import Signal
+from Signal import Signal, shannon_indices
+from SignalStore import SignalStore
 from PipelineTimer import PipelineTimer
+from typing import List
 
 
 def tokenize_dictionary(a_timer:            PipelineTimer,
@@ -31,101 +33,78 @@ def tokenize_dictionary(a_timer:            PipelineTimer,
 
 
 # This is a greedy algorithm to cluster bit positions in a series of CAN payloads suspected of being part of a
-# continuous numerical time series.
-def get_composition(arb_id: ArbID, include_padding=False, max_inversion_distance: float = 0.0):
-    tokens = []
-    start_index = 0
-    currently_clustering = False
-    big_endian = True
-    last_bit_position = 0
-
-    # Consider each element in the TANG. The TANG is an ndarray with index being bit position from the
-    # original CAN data. The cell value is the observed transition frequency for that bit position.
-    for i, bit_position in enumerate(nditer(arb_id.tang)):
-        # Is this a padding bit?
-        if bit_position <= 0.000001:
-            arb_id.padding.append(i)
-            # Are we clustering padding bits? If so, proceed to the normal clustering logic. Else, do the following.
-            if not include_padding:
-                if currently_clustering:
-                    # This is padding, we're already clustering, and we're not clustering padding; save the token.
-                    tokens.append((start_index, i - 1))
-                    currently_clustering = False
-                    start_index = i + 1
-                    last_bit_position = bit_position
-                continue
-
-        # Are we still enlarging the current token?
-        if currently_clustering:
-            if bit_position >= last_bit_position and big_endian:
-                pass
-            elif bit_position <= last_bit_position and not big_endian:
-                pass
-            # Are we allowing inversions (max_inversion_distance > 0)? If so, check if this inversion is acceptable.
-            elif abs(bit_position-last_bit_position) <= max_inversion_distance:
-                pass
-            # Is this the second bit position we need to establish the endian of the signal?
-            elif start_index == i - 1:
-                if bit_position >= last_bit_position:
-                    big_endian = True
-                else:
-                    big_endian = False
-            # This is an unacceptable transition frequency inversion, save the current token and start a new one
-            else:
-                tokens.append((start_index, i - 1))
-                start_index = i
-        # We aren't currently clustering and we intend to cluster this bit position
-        else:
-            currently_clustering = True
-            start_index = i
-
-        last_bit_position = bit_position
+# continuous numerical time series. Each row of tangs is one TANG and every row must have the same bit width, so TANGs
+# from many Arb IDs (grouped by DLC) or from many folds can be tokenized in one call. max_inversion_distance and
+# max_merge_distance may be one value for every row or one value per row. Merging is skipped if max_merge_distance is
+# None.
+# The greedy rules are a small state machine along the bit positions, so the loop runs once per bit position and each
+# step is applied to every row at once. Tokens come back as two boolean matrices shaped like tangs: starts marks the
+# first bit position of each token and members marks every bit position inside a token. See tokens_from_matrix.
+def tokenize_tangs(tangs, include_padding=False, max_inversion_distance=0.0, max_merge_distance=None):
+    tangs = atleast_2d(asarray(tangs, dtype=float64))
+    n, bit_width = tangs.shape
+    max_inversion_distance = broadcast_to(asarray(max_inversion_distance, dtype=float64), (n,))
+    members = ones((n, bit_width), dtype=bool) if include_padding else tangs > 0.000001
+    starts = zeros((n, bit_width), dtype=bool)
+    big_endian = ones(n, dtype=bool)
+    currently_clustering = zeros(n, dtype=bool)
+    start_index = full(n, -2, dtype=int64)
+    last_bit_position = zeros(n, dtype=float64)
+
+    for i in range(bit_width):
+        bit_position = tangs[:, i]
+        active = members[:, i]
+        # Padding bits end the current token if we're not clustering padding.
+        currently_clustering &= active
+        rising = bit_position >= last_bit_position
+        # Is this bit position in the direction of the current endian or an acceptable inversion?
+        acceptable = (rising & big_endian) | ((bit_position <= last_bit_position) & ~big_endian) | \
+                     (absolute(bit_position - last_bit_position) <= max_inversion_distance)
+        # Is this the second bit position we need to establish the endian of the signal?
+        set_endian = currently_clustering & ~acceptable & (start_index == i - 1)
+        big_endian[set_endian] = rising[set_endian]
+        # Start a new token if we weren't clustering or this is an unacceptable transition frequency inversion.
+        new_token = active & ~(currently_clustering & (acceptable | set_endian))
+        starts[:, i] = new_token
+        start_index[new_token] = i
+        currently_clustering |= active
+        last_bit_position[active] = bit_position[active]
+
+    if max_merge_distance is not None:
+        # Merge adjacent tokens when the transition frequencies on either side of their border are close enough.
+        max_merge_distance = broadcast_to(asarray(max_merge_distance, dtype=float64), (n,))
+        close = absolute(diff(tangs, axis=1)) <= max_merge_distance.reshape(-1, 1)
+        starts[:, 1:] &= ~(members[:, :-1] & close)
+
+    return starts, members
+
+
+def tokens_from_matrix(starts: ndarray, members: ndarray) -> List[tuple]:
+    # Convert one row of tokenize_tangs output to a list of (start, stop) tuples, stop inclusive.
+    stops = members & append(starts[1:] | ~members[1:], True)
+    return list(zip(flatnonzero(starts).tolist(), flatnonzero(stops).tolist()))
 
-    # We reached the last bit position while clustering. Add this final token.
-    if currently_clustering:
-        tokens.append((start_index, arb_id.tang.__len__() - 1))
 
-    arb_id.tokenization = tokens
+def get_composition(arb_id: ArbID, include_padding=False, max_inversion_distance: float = 0.0):
+    starts, members = tokenize_tangs(arb_id.tang, include_padding, max_inversion_distance)
+    arb_id.padding.extend(flatnonzero(arb_id.tang <= 0.000001).tolist())
+    arb_id.tokenization = tokens_from_matrix(starts[0], members[0])
 
 
 def merge_tokens(arb_id: ArbID, max_distance):
-    # if arb_id.id == 292:  # make this equal to the decimal value of an Arb ID in the data you want to see get merged
-    #     verbose = True
-    # else:
-    verbose = False
-    if verbose:
-        print("\nENTERING MERGE PHASE OF ARB ID", arb_id.id)
-        print("STARTING TOKENS:", arb_id.tokenization)
-
     if arb_id.static or arb_id.tokenization.__len__() < 2:
         # Make sure there's multiple tokens to marge
-        pass
-    else:
-        # Editing data structures while iterating over them is a bad idea in Python
-        # Instead, lets keep track of tokens we want to delete using remove_list.
-        remove_list = []
-        last = None
-        for i, token in enumerate(arb_id.tokenization):
-            if verbose:
-                print("Last:", last, "\tCurrent:", token)
-            if last:
-                # Are these tokens adjacent?
-                if last[1] + 1 == token[0]:
-                    if verbose:
-                        print("\tAdjacent with distance of", abs(arb_id.tang[last[1]] - arb_id.tang[token[0]]))
-                    # Is the transition frequency of the adjacent bit positions less than the max distance threshold?
-                    if abs(arb_id.tang[last[1]] - arb_id.tang[token[0]]) <= max_distance:
-                        remove_list.append(last)
-                        token = (last[0], token[1])
-                        arb_id.tokenization[i] = token
-                        if verbose:
-                            print("\t\tMerged into", token)
-            last = token
-        if remove_list:
-            for token in remove_list:
-                arb_id.tokenization.remove(token)
-            if verbose:
-                print("final tokenization", arb_id.tokenization)
+        return
+    # Each border between two adjacent tokens is merged away if the transition frequencies of the bit positions on
+    # either side of it are within max_distance. Whether a border is merged doesn't depend on any other border.
+    token_array = array(arb_id.tokenization, dtype=int64)
+    last_stops = token_array[:-1, 1]
+    next_starts = token_array[1:, 0]
+    merged = (last_stops + 1 == next_starts) & \
+             (absolute(arb_id.tang[last_stops] - arb_id.tang[next_starts]) <= max_distance)
+    keep_starts = concatenate(([True], ~merged))
+    keep_stops = concatenate((~merged, [True]))
+    arb_id.tokenization = list(zip(token_array[keep_starts, 0].tolist(), token_array[keep_stops, 1].tolist()))
 
 
 # noinspection PyTypeChecker
@@ -147,23 +126,26 @@ def          generate_signals(a_timer: PipelineTimer,
     signal_dict = {}
 
     for k, arb_id in arb_id_dict.items():
-        if not arb_id.static:
-            for token in arb_id.tokenization:
+        if not arb_id.static and arb_id.tokenization:
+            # Convert every token of this Arb ID to unsigned integers in one batched shift and mask of the payloads.
+            # This works the same whether or not the Arb ID was generated with pack_bits.
+            token_values = arb_id.extract_tokens(arb_id.tokenization)
+            # Find every token's Shannon index from its integer values, then normalize every token at once. Each
+            # column is normalized on its own, the same as normalize_strategy with its default axis=0 (e.g. sklearn's
+            # minmax_scale) would normalize one signal. Column major order keeps each signal's values contiguous.
+            shannon = shannon_indices(token_values)
+            normalized_values = token_values.astype(float64, order='F')
+            normalize_strategy(normalized_values, copy=False)
+            # Every signal of this Arb ID is a column of one float32 store sharing the Arb ID's time stamps.
+            store = SignalStore(arb_id.original_data.time, normalized_values)
+            for j, token in enumerate(arb_id.tokenization):
                 a_timer.start_iteration_time()
 
                 signal = Signal(k, token[0], token[1])
-
-                # Convert the binary ndarray to a list of string representations of each row
-                temp1 = [''.join(str(x) for x in row) for row in arb_id.boolean_matrix[:, token[0]:token[1] + 1]]
-                temp2 = zeros((temp1.__len__(), 1), dtype=uint64)
-                # convert each string representation to int
-                for i, row in enumerate(temp1):
-                    temp2[i] = int(row, 2)
-
-                # create an unsigned integer pandas.Series using the time index from this Arb ID's original data.
-                signal.time_series = Series(temp2[:, 0], index=arb_id.original_data.index, dtype=float64)
-                # Normalize the signal and update its meta-data
-                signal.normalize_and_set_metadata(normalize_strategy)
+                signal.store = store
+                signal.store_column = j
+                # Update the signal's meta-data
+                signal.set_metadata(float(shannon[j]))
                 # add this signal to the signal dictionary which is keyed by Arbitration ID
                 if k in signal_dict:
                     signal_dict[k][(arb_id.id, signal.start_index, signal.stop_index)] = signal
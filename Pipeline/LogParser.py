@@ -0,0 +1,174 @@
+from numpy import arange, argsort, bincount, concatenate, cumsum, empty, flatnonzero, float64, frombuffer, full, \
+    maximum, minimum, nan, ndarray, searchsorted, uint8, uint32, uint64, where, zeros
+from pandas import Series, to_numeric
+from CanFrames import CanFrames
+
+# ASCII codes the parser cares about.
+newline:            int = ord('\n')
+carriage_return:    int = ord('\r')
+tab:                int = ord('\t')
+space:              int = ord(' ')
+
+# Maps an ASCII code to the value of that hex digit. Null and whitespace map to 254 so they are skipped during decoding.
+# Anything else maps to 255 and is reported as an invalid value.
+hex_digit_lookup: ndarray = full(256, 255, dtype=uint8)
+hex_digit_lookup[frombuffer(b'0123456789', dtype=uint8)] = arange(10)
+hex_digit_lookup[frombuffer(b'abcdef', dtype=uint8)] = arange(10, 16)
+hex_digit_lookup[frombuffer(b'ABCDEF', dtype=uint8)] = arange(10, 16)
+hex_digit_lookup[[0, tab, carriage_return, space]] = 254
+
+# Number of bytes read from disk at a time. Each block is trimmed back to its last newline before being parsed.
+default_block_size: int = 1 << 24
+
+
+def split_fields(buffer: ndarray, delimiter: str = None):
+    # Find the [start, end) byte offsets, row number, and column number of every field in a buffer of complete lines.
+    if delimiter is None:
+        # Fields are runs of non-whitespace characters. This matches read_csv(sep=r'\s+').
+        is_gap = (buffer == space) | (buffer == tab) | (buffer == carriage_return) | (buffer == newline)
+        edges = flatnonzero(concatenate(([True], is_gap)) != concatenate((is_gap, [True])))
+        starts = edges[0::2]
+        ends = edges[1::2]
+        # A field starts a new line if a newline sits in the gap in front of it. Blank lines have no fields at all.
+        new_line = zeros(starts.shape[0] + 1, dtype=bool)
+        new_line[searchsorted(starts, flatnonzero(buffer == newline))] = True
+        new_line = new_line[:-1]
+        new_line[:1] = True
+    else:
+        # Fields sit between delimiters and may be empty. This matches read_csv(delimiter=delimiter).
+        separators = flatnonzero((buffer == ord(delimiter)) | (buffer == newline))
+        starts = concatenate(([0], separators + 1))
+        ends = concatenate((separators, [buffer.shape[0]]))
+        new_line = concatenate(([True], buffer[separators] == newline))
+        # Don't let Windows line endings leak into the last field of each line.
+        ends -= (ends > starts) & (buffer[ends - 1] == carriage_return)
+        # Skip blank lines like read_csv does.
+        row = cumsum(new_line) - 1
+        has_text = bincount(row, weights=ends > starts) > 0
+        if not has_text.all():
+            keep = has_text[row]
+            starts, ends, row = starts[keep], ends[keep], row[keep]
+            new_line = concatenate(([True], row[1:] != row[:-1]))[:row.shape[0]]
+
+    field_index = arange(starts.shape[0])
+    column = field_index - maximum.accumulate(where(new_line, field_index, 0))
+    row = cumsum(new_line) - 1
+    return starts, ends, row, column
+
+
+def gather_fields(buffer: ndarray, starts: ndarray, ends: ndarray) -> ndarray:
+    # Copy each field into its own left-aligned, null-padded row of an (n, width) matrix of ASCII codes.
+    lengths = ends - starts
+    width = int(lengths.max()) if lengths.shape[0] else 0
+    chars = zeros((starts.shape[0], width), dtype=uint8)
+    # Fields in a given column are nearly always the same width (e.g. two hex digits per payload byte). Skip the
+    # padding logic when that's the case.
+    uniform = (lengths == width).all()
+    for k in range(width):
+        if uniform:
+            chars[:, k] = buffer[starts + k]
+        else:
+            chars[:, k] = where(lengths > k, buffer[minimum(starts + k, buffer.shape[0] - 1)], 0)
+    return chars
+
+
+def hex2int(chars: ndarray) -> ndarray:
+    # Vectorized int(x, 16) over a matrix of ASCII codes built by gather_fields. Empty fields decode to 0.
+    if chars.shape[1] > 2:
+        # Tolerate an optional 0x prefix like int(x, 16) does.
+        prefixed = (chars[:, 0] == ord('0')) & ((chars[:, 1] == ord('x')) | (chars[:, 1] == ord('X')))
+        if prefixed.any():
+            chars[prefixed, :2] = 0
+    digits = hex_digit_lookup[chars]
+    if (digits == 255).any():
+        bad_row = flatnonzero((digits == 255).any(axis=1))[0]
+        raise ValueError("Invalid hexadecimal value '" + chars[bad_row].tobytes().decode('ascii', 'replace').strip(
+            '\x00') + "' found in the CAN log.")
+    in_cell = digits < 16
+    padded = not in_cell.all()
+    if padded and chars.shape[1] > 16 and in_cell.sum(axis=1).max() > 16 or not padded and chars.shape[1] > 16:
+        raise ValueError("Hexadecimal value in the CAN log is too wide to fit in 64 bits.")
+    # Horner's method one character column at a time, skipping null and whitespace padding.
+    values = zeros(chars.shape[0], dtype=uint64)
+    for j in range(chars.shape[1]):
+        if padded:
+            values = where(in_cell[:, j], values * 16 + digits[:, j], values)
+        else:
+            values = values * 16 + digits[:, j]
+    return values
+
+
+def fix_time(chars: ndarray) -> ndarray:
+    # Vectorized float(str(x)[:-1]) over a matrix of ASCII codes. The logger appends one character to each time stamp.
+    if chars.shape[1] == 0:
+        return full(chars.shape[0], nan, dtype=float64)
+    lengths = (chars != 0).sum(axis=1)
+    has_text = flatnonzero(lengths)
+    chars[has_text, lengths[has_text] - 1] = 0
+    text = chars.view('S' + str(chars.shape[1])).ravel()
+    try:
+        return text.astype(float64)
+    except ValueError:
+        # There may have been a newline the capture device was trying to write when turned off. Anything that doesn't
+        # parse becomes NaN.
+        return to_numeric(Series(text).str.decode('ascii'), errors='coerce').to_numpy(dtype=float64)
+
+
+def parse_buffer(buffer: ndarray, delimiter: str = None) -> CanFrames:
+    # Parse a buffer of complete loggerProgram lines (time, id, dlc, b0 ... b7) straight into typed numpy columns.
+    if buffer.shape[0] == 0:
+        starts, ends, row, column = (empty(0, dtype=int) for _ in range(4))
+    else:
+        starts, ends, row, column = split_fields(buffer, delimiter)
+    n = int(row[-1]) + 1 if row.shape[0] else 0
+
+    frames = CanFrames(full(n, nan, dtype=float64), zeros(n, dtype=uint32), zeros(n, dtype=uint8),
+                       zeros((n, 8), dtype=uint8))
+
+    # Group the fields by column once instead of masking every field for every column.
+    by_column = argsort(minimum(column, 11).astype(uint8), kind='stable')
+    column_edges = concatenate(([0], cumsum(bincount(minimum(column, 11), minlength=12))))
+    for j in range(11):
+        in_column = by_column[column_edges[j]:column_edges[j + 1]]
+        if in_column.shape[0] == 0:
+            continue
+        chars = gather_fields(buffer, starts[in_column], ends[in_column])
+        these_rows = row[in_column]
+        if j == 0:
+            frames.time[these_rows] = fix_time(chars)
+        elif j == 1:
+            frames.id[these_rows] = hex2int(chars)
+        elif j == 2:
+            frames.dlc[these_rows] = hex2int(chars)
+        else:
+            frames.payload[these_rows, j - 3] = hex2int(chars)
+    return frames
+
+
+def iter_log(filename: str, skip_rows: int = 7, delimiter: str = None, block_size: int = default_block_size):
+    # Yield the frames of a loggerProgram log one block at a time. Each block is trimmed back to its last newline so no
+    # line is ever split between two blocks. Peak memory is bounded by block_size rather than the size of the capture.
+    with open(filename, 'rb') as f:
+        for _ in range(skip_rows):
+            f.readline()
+        remainder = b''
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            block = remainder + block
+            cut = block.rfind(b'\n') + 1
+            if cut == 0:
+                remainder = block
+                continue
+            remainder = block[cut:]
+            yield parse_buffer(frombuffer(block, dtype=uint8, count=cut), delimiter)
+        if remainder:
+            yield parse_buffer(frombuffer(remainder, dtype=uint8), delimiter)
+
+
+def read_log(filename: str, skip_rows: int = 7, delimiter: str = None,
+             block_size: int = default_block_size) -> CanFrames:
+    # Read a whole loggerProgram log into typed numpy columns. The file is still parsed one block at a time so the
+    # temporary per-byte arrays stay small no matter how large the capture is.
+    return CanFrames.concatenate(list(iter_log(filename, skip_rows, delimiter, block_size)))
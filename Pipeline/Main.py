@@ -7,7 +7,7 @@ from PreProcessor import PreProcessor
 from LexicalAnalysis import tokenize_dictionary, generate_signals
 from SemanticAnalysis import subset_selection, subset_correlation, greedy_signal_clustering, label_propagation, \
     j1979_signal_labeling
-from Plotter import plot_j1979, plot_signals_by_arb_id, plot_signals_by_cluster
+from Plotter import plot_j1979, plot_signals_by_arb_id, plot_signals_by_cluster, plot_windowed_tangs
 from PipelineTimer import PipelineTimer
 from FromCanUtilsLog import canUtilsToTSV
 
@@ -40,7 +40,8 @@ csv_correlation_filename:   str = 'subset_correlation_matrix.csv'
 pickle_j1979_correlation:   str = 'pickleJ1979_correlation.p'
 pickle_clusters_filename:   str = 'pickleClusters.p'
 pickle_all_signal_filename: str = 'pickleAllSignalsDataFrame.p'
-csv_all_signals_filename:   str = 'complete_correlation_matrix.csv'
+pickle_subset_graph_filename: str = 'pickleSubsetCorrelationGraph.p'
+pickle_full_graph_filename: str = 'pickleCompleteCorrelationGraph.p'
 pickle_timer_filename:      str = 'pickleTimer.p'
 
 # Change out the normalization strategies as needed.
@@ -53,6 +54,7 @@ force_j1979_plotting:       bool = False
 
 force_lexical_analysis:     bool = False
 force_arb_id_plotting:      bool = True
+force_windowed_tang_plotting: bool = False
 
 force_semantic_analysis:    bool = False
 force_signal_labeling:      bool = False
@@ -66,6 +68,19 @@ time_conversion = 1000  # convert seconds to milliseconds
 z_lookup = {.8: 1.28, .9: 1.645, .95: 1.96, .98: 2.33, .99: 2.58}
 freq_analysis_accuracy = z_lookup[0.9]
 freq_synchronous_threshold = 0.1
+# Nominal bit rate of the captured bus in bits per second. Used to estimate each Arb ID's share of the bus load.
+bus_bit_rate:               int = 500000
+# Set to a block size in bytes (e.g. 1 << 24) to read the log in that many bytes at a time instead of importing it
+# whole. The log's text and DataFrame are never held whole, but memory still grows with the number of frames since each
+# Arb ID keeps its frames' time stamps and payload bytes. 0 imports the whole log.
+streaming_block_size:       int = 0
+# Set to True to keep each Arb ID's bits packed 8 per byte instead of building its boolean matrix (one byte per bit).
+# This cuts memory and the pickled Arb ID dictionary by up to 8x for long captures.
+pack_boolean_matrix:        bool = False
+# Set to a window length to plot each Arb ID's TANG over consecutive windows of the capture as a heatmap. The window is
+# in seconds, or in frames if tang_window_by_time is False. 0 turns windowed TANG plotting off.
+tang_window:                float = 0.0
+tang_window_by_time:        bool = True
 
 # Threshold parameters used during lexical analysis.
 tokenization_bit_distance:  float = 0.2
@@ -75,6 +90,12 @@ tokenize_padding:           bool = True
 subset_selection_size:      float = 0.25
 fuzzy_labeling:             bool = True
 min_correlation_threshold:  float = 0.85
+# Set to True to keep just the signal pairs whose correlation could clear min_correlation_threshold, as a sparse
+# correlation graph, instead of the dense subset correlation matrix.
+sparse_correlation:         bool = False
+
+# A sparse correlation graph is pickled in place of the dense correlation matrix .csv file.
+subset_correlation_filename: str = pickle_subset_graph_filename if sparse_correlation else csv_correlation_filename
 
 # A timer class to record timings throughout the pipeline.
 a_timer = PipelineTimer(verbose=True)
@@ -87,9 +108,14 @@ id_dictionary, j1979_dictionary = pre_processor.generate_arb_id_dictionary(a_tim
                                                                            time_conversion,
                                                                            freq_analysis_accuracy,
                                                                            freq_synchronous_threshold,
-                                                                           force_pre_processing)
+                                                                           force_pre_processing,
+                                                                           streaming_block_size,
+                                                                           pack_boolean_matrix,
+                                                                           bus_bit_rate)
 if j1979_dictionary:
     plot_j1979(a_timer, j1979_dictionary, force_j1979_plotting)
+if tang_window:
+    plot_windowed_tangs(a_timer, id_dictionary, tang_window, tang_window_by_time, force_windowed_tang_plotting)
 
 
 #                 LEXICAL ANALYSIS                     #
@@ -116,18 +142,19 @@ subset_df = subset_selection(a_timer,
                              force_semantic_analysis,
                              subset_size=subset_selection_size)
 corr_matrix_subset = subset_correlation(
-    subset_df, csv_correlation_filename, force_semantic_analysis)
+    subset_df, subset_correlation_filename, force_semantic_analysis, sparse_correlation, min_correlation_threshold)
 cluster_dict = greedy_signal_clustering(corr_matrix_subset,
                                         correlation_threshold=min_correlation_threshold,
                                         fuzzy_labeling=fuzzy_labeling)
-df_full, corr_matrix_full, cluster_dict = label_propagation(a_timer,
+df_full, corr_graph_full, cluster_dict = label_propagation(a_timer,
                                                             pickle_clusters_filename=pickle_clusters_filename,
                                                             pickle_all_signals_df_filename=pickle_all_signal_filename,
-                                                            csv_signals_correlation_filename=csv_all_signals_filename,
+                                                            pickle_signals_graph_filename=pickle_full_graph_filename,
                                                             signal_dict=signal_dictionary,
                                                             cluster_dict=cluster_dict,
                                                             correlation_threshold=min_correlation_threshold,
-                                                            force=force_semantic_analysis)
+                                                            force=force_semantic_analysis,
+                                                            subset_df=subset_df)
 signal_dictionary, j1979_correlations = j1979_signal_labeling(a_timer=a_timer,
                                                               j1979_corr_filename=pickle_j1979_correlation,
                                                               df_signals=df_full,
@@ -151,16 +178,16 @@ if dump_to_pickle:
     if force_semantic_analysis:
         if path.isfile(pickle_subset_filename):
             remove(pickle_subset_filename)
-        if path.isfile(csv_correlation_filename):
-            remove(csv_correlation_filename)
+        if path.isfile(subset_correlation_filename):
+            remove(subset_correlation_filename)
         if path.isfile(pickle_j1979_correlation):
             remove(pickle_j1979_correlation)
         if path.isfile(pickle_clusters_filename):
             remove(pickle_clusters_filename)
         if path.isfile(pickle_all_signal_filename):
             remove(pickle_all_signal_filename)
-        if path.isfile(csv_all_signals_filename):
-            remove(csv_all_signals_filename)
+        if path.isfile(pickle_full_graph_filename):
+            remove(pickle_full_graph_filename)
 
     timer_flag = 0
     if not path.exists(output_folder):
@@ -186,10 +213,13 @@ if dump_to_pickle:
         print("\nDumping signal subset list to " + pickle_subset_filename)
         dump(subset_df, open(pickle_subset_filename, "wb"))
         print("\tComplete...")
-    if not path.isfile(csv_correlation_filename):
+    if not path.isfile(subset_correlation_filename):
         timer_flag += 1
-        print("\nDumping subset correlation matrix to " + csv_correlation_filename)
-        corr_matrix_subset.to_csv(csv_correlation_filename)
+        print("\nDumping subset correlation matrix to " + subset_correlation_filename)
+        if sparse_correlation:
+            dump(corr_matrix_subset, open(subset_correlation_filename, "wb"))
+        else:
+            corr_matrix_subset.to_csv(subset_correlation_filename)
         print("\tComplete...")
     if not path.isfile(pickle_j1979_correlation):
         timer_flag += 1
@@ -208,11 +238,11 @@ if dump_to_pickle:
               pickle_all_signal_filename)
         dump(df_full, open(pickle_all_signal_filename, "wb"))
         print("\tComplete...")
-    if not path.isfile(csv_all_signals_filename):
+    if not path.isfile(pickle_full_graph_filename):
         timer_flag += 1
-        print("\nDumping complete correlation matrix to " +
-              csv_all_signals_filename)
-        corr_matrix_full.to_csv(csv_all_signals_filename)
+        print("\nDumping complete correlation graph to " +
+              pickle_full_graph_filename)
+        dump(corr_graph_full, open(pickle_full_graph_filename, "wb"))
         print("\tComplete...")
     if timer_flag == 9:
         print("\nDumping pipeline timer to " + pickle_timer_filename)
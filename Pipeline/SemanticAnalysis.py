@@ -1,12 +1,19 @@
-from pandas import concat, DataFrame, read_csv
-from numpy import zeros
+from pandas import DataFrame, read_csv
+from numpy import around, array, concatenate, fill_diagonal, lexsort, ndarray, nonzero, zeros
 from os import path, remove
 from pickle import load
 from ast import literal_eval
 from J1979 import J1979
 from Signal import Signal
+from SignalStore import align_signals
+from Correlation import CorrelationGraph, correlation_graph, cross_correlation, pearson_correlation, \
+    reachable_correlation_graph
 from PipelineTimer import PipelineTimer
 
+# Correlations are rounded to 2 decimal places before they're compared with a threshold, so a sparse correlation graph
+# keeps every pair that could round up to the threshold.
+rounding_margin: float = 0.006
+
 
 def subset_selection(a_timer:       PipelineTimer,
                      signal_dict:   dict = None,
@@ -51,25 +58,14 @@ def subset_selection(a_timer:       PipelineTimer,
 
     # Re-index each Signal in the subset using the Signal with the most observed samples. Prepare to create a DataFrame
     # that can be used for generating a correlation matrix.
-    subset = []
-    subset_cols = []
-    largest_index = []
+    subset = {}
 
     for index, row in df.iterrows():
         signal_id = (int(row[0]), int(row[1]), int(row[2]))
         signal = signal_dict[row[0]][signal_id]
-        subset.append(signal)
-        subset_cols.append(signal_id)
-        if signal.time_series.__len__() > largest_index.__len__():
-            largest_index = signal.time_series.index
-
-    subset_df: DataFrame = DataFrame(zeros((largest_index.__len__(), subset.__len__())),
-                                     columns=subset_cols,
-                                     index=largest_index)
+        subset[(signal.arb_id, signal.start_index, signal.stop_index)] = signal
 
-    for signal in subset:
-        signal_id = (signal.arb_id, signal.start_index, signal.stop_index)
-        subset_df[signal_id] = signal.time_series.reindex(index=largest_index, method='nearest')
+    subset_df: DataFrame = align_signals(subset)
 
     a_timer.set_subset_selection()
 
@@ -78,200 +74,192 @@ def subset_selection(a_timer:       PipelineTimer,
 
 def subset_correlation(subset: DataFrame,
                        csv_correlation_filename: str,
-                       force: bool = False) -> DataFrame:
+                       force: bool = False,
+                       sparse: bool = False,
+                       correlation_threshold: float = 0.8):
+    # If sparse is True, return a CorrelationGraph of just the signal pairs that could clear correlation_threshold
+    # instead of the dense correlation matrix. The graph is pickled to csv_correlation_filename instead of written as a
+    # .csv.
     if not force and path.isfile(csv_correlation_filename):
         print("\nA subset correlation appears to exist and forcing is turned off. Using " + csv_correlation_filename)
+        if sparse:
+            return load(open(csv_correlation_filename, "rb"))
         # Read the .csv into a DataFrame. Also, we need to convert the columns and index from strings back to tuples.
         # Pandas.read_csv brings the data in as a DataFrame. Pandas.DataFrame.rename converts the columns and index with
         # ast.literal_eval. Literal_eval will convert a string representation of a tuple back to an actual tuple.
         return read_csv(csv_correlation_filename, index_col=0).rename(index=literal_eval, columns=literal_eval)
+    elif sparse:
+        return correlation_graph(subset, correlation_threshold - rounding_margin)
     else:
-        return subset.corr()
-
-
-def greedy_signal_clustering(correlation_matrix: DataFrame = None,
+        return pearson_correlation(subset)
+
+
+def significant_pairs(correlation, correlation_threshold: float) -> (ndarray, ndarray, ndarray):
+    # Return the signal IDs of a correlation matrix or CorrelationGraph and the (row, col) positions of every off
+    # diagonal cell whose correlation, rounded to 2 decimal places, is at least correlation_threshold. The cells are in
+    # the row by row order of the matrix, so each pair of signals appears once in each order.
+    if isinstance(correlation, CorrelationGraph):
+        significant = around(correlation.coefficients, 2) >= correlation_threshold
+        rows = concatenate((correlation.rows[significant], correlation.cols[significant]))
+        cols = concatenate((correlation.cols[significant], correlation.rows[significant]))
+        order = lexsort((cols, rows))
+        return correlation.signal_ids, rows[order], cols[order]
+    # I chose to round here to allow relationships 'oh so close' to making it. No reason this HAS to be done.
+    significant = around(correlation.values, 2) >= correlation_threshold
+    # Skip the diagonal of the correlation matrix.
+    fill_diagonal(significant, False)
+    rows, cols = nonzero(significant)
+    return correlation.columns.values, rows, cols
+
+
+def greedy_signal_clustering(correlation_matrix=None,
                              correlation_threshold: float = 0.8,
                              fuzzy_labeling: bool = True) -> dict:
-
-    correlation_keys = correlation_matrix.columns.values
-    previously_clustered_signals = {}
-    cluster_dict = {}
+    # correlation_matrix may be a dense correlation matrix or a CorrelationGraph.
+    correlation_keys, significant_rows, significant_cols = significant_pairs(correlation_matrix, correlation_threshold)
+    # Signals are tracked by their position in correlation_keys. signal_labels[i] is the set of cluster labels signal i
+    # belongs to, or None if it's unlabeled. Label sets are interned, so signals with the same labels share one
+    # frozenset and can be compared with 'is'.
+    signal_labels = [None] * correlation_keys.__len__()
+    interned_label_sets = {}
+    clusters = {}
     new_cluster_label = 0
 
-    for n, row in enumerate(correlation_keys):
-        for m, col in enumerate(correlation_keys):
-            if n == m:
-                # this is a diagonal on the correlation matrix. Skip it.
+    # Visit every significant correlation according to our heuristic threshold.
+    for n, m in zip(significant_rows.tolist(), significant_cols.tolist()):
+        row_label_set = signal_labels[n]
+        col_label_set = signal_labels[m]
+        if row_label_set is col_label_set:
+            if row_label_set is not None:
+                # Both signals already have exactly the same labels. Nothing below would change.
                 continue
-            # I chose to round here to allow relationships 'oh so close' to making it. No reason this HAS to be done.
-            result = round(correlation_matrix.iloc[n, m], 2)
-
-            # check if this is a significant correlation according to our heuristic threshold.
-            if result >= correlation_threshold:
-                # Check if the current row signal is currently unlabeled
-                if row not in previously_clustered_signals.keys():
-                    # Check if the current col signal is currently unlabeled
-                    if col not in previously_clustered_signals.keys():
-                        # Both signals are unlabeled. Create a new one.
-                        cluster_dict[new_cluster_label] = [row, col]
-                        previously_clustered_signals[row] = {new_cluster_label}
-                        previously_clustered_signals[col] = {new_cluster_label}
-                        # print("created new cluster #", new_cluster_label, cluster_dict[new_cluster_label])
-                        new_cluster_label += 1
-                    else:
-                        # Row isn't labeled but col is; add row to all of col's clusters.
-                        # print("adding", row, "to clusters", previously_clustered_signals[col])
-                        # row is not already in a cluster, add it to col's set of clusters
-                        for label in previously_clustered_signals[col]:
-                            cluster_dict[label].append(row)
-                        previously_clustered_signals[row] = previously_clustered_signals[col]
-                else:
-                    # Check if the current col signal is currently unlabeled
-                    if col not in previously_clustered_signals.keys():
-                        # Row if labeled but col is not; add col to row's set of clusters
-                        # print("adding", col, "to clusters", previously_clustered_signals[row])
-                        for label in previously_clustered_signals[row]:
-                            cluster_dict[label].append(col)
-                        previously_clustered_signals[col] = previously_clustered_signals[row]
-                    # Both signals are already labeled
-                    else:
-                        # Check if we're using fuzzy labeling (a signal can belong to multiple clusters).
-                        # If so, check if the union of both sets of labels is the empty set. If so, this is a
-                        # relationship that hasn't already been captures by an existing cluster. Make a new one.
-                        if fuzzy_labeling:
-                            row_label_set = previously_clustered_signals[row]
-                            col_label_set = previously_clustered_signals[col]
-                            if not row_label_set & col_label_set:
-                                cluster_dict[new_cluster_label] = [row, col]
-                                previously_clustered_signals[row] = {new_cluster_label} | row_label_set
-                                previously_clustered_signals[col] = {new_cluster_label} | col_label_set
-                                # print("created new cluster #", new_cluster_label, cluster_dict[new_cluster_label])
-                                new_cluster_label += 1
-                            else:
-                                # We're using fuzzy labeling and these two signals represent a 'bridge' between two
-                                # signal clusters. Fold col into row's clusters and delete col's unique cluster indices.
-                                for label in row_label_set - col_label_set:
-                                    cluster_dict[label].append(col)
-                                previously_clustered_signals[col] = row_label_set | col_label_set
-                                for label in col_label_set - row_label_set:
-                                    cluster_dict[label].append(row)
-                                previously_clustered_signals[row] = row_label_set | col_label_set
-                        # print(row, col, "already in cluster_dict", previously_clustered_signals[row], "&",
-                        #       previously_clustered_signals[col])
-
-    # Delete any duplicate clusters
-    cluster_sets = []
-    deletion_labels = []
-    for label, cluster in cluster_dict.items():
-        this_set = set(cluster)
-        if this_set in cluster_sets:
-            deletion_labels.append(label)
-        else:
-            cluster_sets.append(this_set)
-    for label in deletion_labels:
-        del cluster_dict[label]
+            # Both signals are unlabeled. Create a new one.
+            clusters[new_cluster_label] = [n, m]
+            new_label_set = frozenset((new_cluster_label,))
+            signal_labels[n] = signal_labels[m] = interned_label_sets.setdefault(new_label_set, new_label_set)
+            new_cluster_label += 1
+        elif row_label_set is None:
+            # Row isn't labeled but col is; add row to all of col's clusters.
+            for label in col_label_set:
+                clusters[label].append(n)
+            signal_labels[n] = col_label_set
+        elif col_label_set is None:
+            # Row is labeled but col is not; add col to row's set of clusters
+            for label in row_label_set:
+                clusters[label].append(m)
+            signal_labels[m] = row_label_set
+        # Both signals are already labeled. Check if we're using fuzzy labeling (a signal can belong to multiple
+        # clusters).
+        elif fuzzy_labeling:
+            if row_label_set.isdisjoint(col_label_set):
+                # This is a relationship that hasn't already been captured by an existing cluster. Make a new one.
+                clusters[new_cluster_label] = [n, m]
+                new_label_set = row_label_set | {new_cluster_label}
+                signal_labels[n] = interned_label_sets.setdefault(new_label_set, new_label_set)
+                new_label_set = col_label_set | {new_cluster_label}
+                signal_labels[m] = interned_label_sets.setdefault(new_label_set, new_label_set)
+                new_cluster_label += 1
+            else:
+                # These two signals represent a 'bridge' between two signal clusters. Fold col into row's clusters and
+                # row into col's clusters.
+                for label in row_label_set - col_label_set:
+                    clusters[label].append(m)
+                for label in col_label_set - row_label_set:
+                    clusters[label].append(n)
+                new_label_set = row_label_set | col_label_set
+                signal_labels[n] = signal_labels[m] = interned_label_sets.setdefault(new_label_set, new_label_set)
+
+    # Delete any duplicate clusters. Each cluster's set of signals is hashed, so a duplicate is found in constant time.
+    cluster_dict = {}
+    cluster_sets = set()
+    for label, cluster in clusters.items():
+        this_set = frozenset(cluster)
+        if this_set not in cluster_sets:
+            cluster_sets.add(this_set)
+            cluster_dict[label] = [correlation_keys[i] for i in cluster]
 
     return cluster_dict
 
 
-# NOTE: This method has a LOT of redundancy with the subset_selection, signal_correlation, and greedy_signal_clustering
-# logic. If you know you always want to perform label propagation, it would be more efficient to incorporate it directly
-# into those functions. Since this code base is more of a Proof of Concept, label propagation is deliberately pulled
-# out as a distinct method to make the pipeline steps as distinct as possible.
+# Propagate the cluster labels found by greedy_signal_clustering from the subset of signals to all the other non-static
+# signals. Only the correlations that can matter are computed: those between signals reachable from the clustered
+# signals through significant correlations, skipping pairs of clustered signals. If subset_df (the DataFrame the subset
+# correlation was computed from) shares the time index of all the signals, pairs of subset signals are skipped too:
+# greedy_signal_clustering labeled every subset signal with a significant correlation to another subset signal, so
+# those pairs can't propagate a label.
 def label_propagation(a_timer:                          PipelineTimer,
                       pickle_clusters_filename:         str = '',
                       pickle_all_signals_df_filename:   str = '',
-                      csv_signals_correlation_filename: str = '',
+                      pickle_signals_graph_filename:    str = '',
                       signal_dict:                      dict = None,
                       cluster_dict:                     dict = None,
                       correlation_threshold:            float = 0.8,
-                      force:                            bool = False):
-    if path.isfile(pickle_all_signals_df_filename) and path.isfile(csv_signals_correlation_filename):
+                      force:                            bool = False,
+                      subset_df:                        DataFrame = None):
+    if path.isfile(pickle_all_signals_df_filename) and path.isfile(pickle_signals_graph_filename):
         if force:
             # Remove any existing data.
             remove(pickle_all_signals_df_filename)
-            remove(csv_signals_correlation_filename)
+            remove(pickle_signals_graph_filename)
             remove(pickle_clusters_filename)
         else:
-            print("\nA DataFrame and correlation matrix for label propagation appears to exist and forcing is turned "
-                  "off. Using " + pickle_all_signals_df_filename + ", " + csv_signals_correlation_filename + ", and "
+            print("\nA DataFrame and correlation graph for label propagation appears to exist and forcing is turned "
+                  "off. Using " + pickle_all_signals_df_filename + ", " + pickle_signals_graph_filename + ", and "
                   + pickle_clusters_filename)
             return [load(open(pickle_all_signals_df_filename, "rb")),
-                    read_csv(csv_signals_correlation_filename, index_col=0).rename(index=literal_eval,
-                                                                                   columns=literal_eval),
+                    load(open(pickle_signals_graph_filename, "rb")),
                     load(open(pickle_clusters_filename, "rb"))]
 
     a_timer.start_function_time()
 
     non_static_signals_dict = {}
-    largest_index = []
-    df_columns = []
 
     # Put all non-static signals into one DataFrame. Re-index all of them to share the same index.
     for k_arb_id, arb_id_signals in signal_dict.items():
         for k_signal_id, signal in arb_id_signals.items():
             if not signal.static:
                 non_static_signals_dict[k_signal_id] = signal
-                df_columns.append(k_signal_id)
-                if signal.time_series.__len__() > largest_index.__len__():
-                    largest_index = signal.time_series.index
 
-    df: DataFrame = DataFrame(zeros((largest_index.__len__(), df_columns.__len__())),
-                              columns=df_columns,
-                              index=largest_index)
+    df: DataFrame = align_signals(non_static_signals_dict)
 
-    for k_signal_id, signal in non_static_signals_dict.items():
-        df[k_signal_id] = signal.time_series.reindex(index=largest_index, method='nearest')
-
-    # Calculate the correlation matrix for this DataFrame of all non-static signals.
-    correlation_matrix = df.corr()
-
-    # Re-run the algorithm from greedy_signal_clustering but omitting the logic for creating new clusters.
-    # This effectively propagates the labels generated by the subset of signals with the largest Shannon Index values
-    # to any correlated signals which were not part of that subset.
-    correlation_keys = correlation_matrix.columns.values
+    # Signals are tracked by their position in df's columns. signal_cluster[i] is the cluster signal i is labeled with,
+    # or None.
     previously_clustered_signals = {}
     for k_cluster_id, cluster in cluster_dict.items():
         for k_signal_id in cluster:
             previously_clustered_signals[k_signal_id] = k_cluster_id
+    signal_cluster = [previously_clustered_signals.get(k_signal_id) for k_signal_id in df.columns.values]
 
-    for n, row in enumerate(correlation_keys):
-        for m, col in enumerate(correlation_keys):
-            if n == m:
-                # this is a diagonal on the correlation matrix. Skip it.
-                continue
-            # I chose to round here to allow relationships 'oh so close' to making it. No reason this HAS to be done.
-            result = round(correlation_matrix.iloc[n, m], 2)
-
-            # check if this is a significant correlation according to our heuristic threshold.
-            if result >= correlation_threshold:
-                # if row signal is already a member of a cluster
-                if row in previously_clustered_signals.keys():
-                    # if col signal is already a member of a cluster
-                    if col in previously_clustered_signals.keys():
-                        # print(row, col, "already in clusters", previously_clustered_signals[row], "&",
-                        #       previously_clustered_signals[col])
-                        continue
-                    # if col is not already in a cluster, add it to row's cluster
-                    else:
-                        # print("adding", col, "to cluster", clusters[previously_clustered_signals[row]])
-                        cluster_dict[previously_clustered_signals[row]].append(col)
-                        previously_clustered_signals[col] = previously_clustered_signals[row]
-                # row signal hasn't been added to a cluster
-                else:
-                    # if col signal is already a member of a cluster
-                    if col in previously_clustered_signals.keys():
-                        # print("adding", row, "to cluster", clusters[previously_clustered_signals[col]])
-                        # row is not already in a cluster, add it to col's cluster
-                        cluster_dict[previously_clustered_signals[col]].append(row)
-                        previously_clustered_signals[row] = previously_clustered_signals[col]
+    clustered = array([cluster_id is not None for cluster_id in signal_cluster], dtype=bool)
+    known = None
+    if subset_df is not None and subset_df.index.equals(df.index):
+        known = df.columns.isin(subset_df.columns)
+    signals_graph = reachable_correlation_graph(df, clustered, correlation_threshold - rounding_margin, known)
+
+    # Re-run the algorithm from greedy_signal_clustering but omitting the logic for creating new clusters.
+    # This effectively propagates the labels generated by the subset of signals with the largest Shannon Index values
+    # to any correlated signals which were not part of that subset. A newly labeled signal can pass its label on to
+    # signals visited after it, so the significant correlations are visited in the same order as before.
+    correlation_keys, significant_rows, significant_cols = significant_pairs(signals_graph, correlation_threshold)
+    for n, m in zip(significant_rows.tolist(), significant_cols.tolist()):
+        row_cluster = signal_cluster[n]
+        col_cluster = signal_cluster[m]
+        if row_cluster is None:
+            if col_cluster is not None:
+                # row is not already in a cluster, add it to col's cluster
+                cluster_dict[col_cluster].append(correlation_keys[n])
+                signal_cluster[n] = col_cluster
+        elif col_cluster is None:
+            # if col is not already in a cluster, add it to row's cluster
+            cluster_dict[row_cluster].append(correlation_keys[m])
+            signal_cluster[m] = row_cluster
 
     a_timer.set_label_propagation()
 
     df.dropna(axis=0, how='any', inplace=True)
     df.dropna(axis=1, how='any', inplace=True)
 
-    return df, correlation_matrix, cluster_dict
+    return df, signals_graph, cluster_dict
 
 
 def j1979_signal_labeling(a_timer:               PipelineTimer,
@@ -311,15 +299,14 @@ def j1979_signal_labeling(a_timer:               PipelineTimer,
     for pid, pid_data in j1979_dict.items():  # type: int, J1979
         df_j1979[pid_data.title] = pid_data.data.reindex(index=df_signals.index, method='nearest')
 
-    df_combined = concat([df_signals, df_j1979], axis=1)
-
-    correlation_matrix = df_combined.corr()
+    # Just consider the J1979 column correlations. Only the signal rows and J1979 columns of the correlation matrix of
+    # the combined signals and J1979 data are computed.
+    correlation_matrix = cross_correlation(df_signals, df_j1979)
 
     correlation_matrix.dropna(axis=1, how='all', inplace=True)
     correlation_matrix.dropna(axis=0, how='all', inplace=True)
 
-    # Just consider the J1979 column correlations. Slice off the identity rows at the end of the DataFrame as well.
-    for index, row in correlation_matrix[df_columns][:-len(df_columns)].iterrows():
+    for index, row in correlation_matrix.iterrows():
         row = abs(row)
         max_index = row.idxmax(axis=1, skipna=True)
         if row[max_index] >= correlation_threshold:
@@ -331,6 +318,6 @@ def j1979_signal_labeling(a_timer:               PipelineTimer,
 
             # print(i, index, row[max_index], max_index, row.values)
 
-    return signal_dict, correlation_matrix[df_columns][:-len(df_columns)]
+    return signal_dict, correlation_matrix
 
     # correlation_matrix.to_csv('j1979_correlation.csv')
@@ -1,35 +1,84 @@
-from pandas import Series
-from math import log10
+from pandas import DataFrame, MultiIndex, Series
+from operator import attrgetter
+from SignalStore import SignalStore
+from numpy import append, bincount, diff, flatnonzero, log10, ndarray, ones, sort, zeros
+
+
+def shannon_indices(values: ndarray) -> ndarray:
+    # Return the Shannon index of every column of values (e.g. all the token values of one Arb ID, before they're
+    # normalized). Each column is sorted once and the run lengths of equal values are its value counts, so no column
+    # needs its own value_counts() call.
+    n, columns = values.shape
+    if n == 0:
+        return zeros(columns)
+    ordered = sort(values, axis=0)
+    # A run of equal values starts at the first row of every column and wherever a value differs from the one above.
+    run_starts = ones((n, columns), dtype=bool)
+    run_starts[1:] = ordered[1:] != ordered[:-1]
+    run_starts = flatnonzero(run_starts.T)
+    # calculate proportion of each value in the total population of values of its column
+    p_i = diff(append(run_starts, n * columns)) / n
+    # calculate the Shannon Index of each column given p_i of its values.
+    return -bincount(run_starts // n, weights=p_i * log10(p_i), minlength=columns)
 
 
 class Signal:
+    # Slots instead of a per instance __dict__ keep thousands of Signals small in memory and in pickles.
+    __slots__ = ('arb_id', 'start_index', 'stop_index', 'store', 'store_column', 'static', 'shannon_index',
+                 'plot_title', 'j1979_title', 'j1979_pcc')
+    # Scalar metadata columns returned by metadata_table.
+    metadata_fields = ('static', 'shannon_index', 'j1979_title', 'j1979_pcc')
+
     def __init__(self, arb_id: int, start_index: int, stop_index: int):
         self.arb_id:        int = arb_id
         self.start_index:   int = start_index
         self.stop_index:    int = stop_index
-        self.time_series:   Series = None
+        # This signal's values are column store_column of store, shared with the other signals of its Arb ID.
+        self.store:         SignalStore = None
+        self.store_column:  int = 0
         self.static:        bool = True
         self.shannon_index: float = 0
         self.plot_title:    str = ""
         self.j1979_title:   str = None
         self.j1979_pcc:     float = 0
 
+    @staticmethod
+    def metadata_table(signal_dictionary: dict, fields: tuple = None) -> DataFrame:
+        # Return a DataFrame with one row per signal and one column per metadata field (metadata_fields by default) for
+        # vectorized access across all the signals of a signal dictionary, e.g. metadata_table(d)['shannon_index'].
+        fields = fields or Signal.metadata_fields
+        get_fields = attrgetter(*fields)
+        keys = [k for signals in signal_dictionary.values() for k in signals.keys()]
+        rows = [get_fields(signal) for signals in signal_dictionary.values() for signal in signals.values()]
+        return DataFrame(rows, columns=list(fields),
+                         index=MultiIndex.from_tuples(keys, names=['arb_id', 'start_index', 'stop_index']))
+
+    @property
+    def time_series(self) -> Series:
+        # The signal as a pandas Series indexed by time. Each access wraps the store's arrays without copying them.
+        return self.store.series(self.store_column)
+
+    @time_series.setter
+    def time_series(self, time_series: Series):
+        # Give this signal a store of its own holding just time_series.
+        self.store = SignalStore(time_series.index.to_numpy(), time_series.to_numpy().reshape(-1, 1))
+        self.store_column = 0
+
     def normalize_and_set_metadata(self, normalize_strategy):
         self.set_shannon_index()
         self.update_static()
         self.set_plot_title()
         self.normalize(normalize_strategy)
 
+    def set_metadata(self, shannon_index: float):
+        # Used when the Shannon index was already found for a batch of signals with shannon_indices and the time
+        # series was normalized along with the rest of its batch.
+        self.shannon_index = shannon_index
+        self.update_static()
+        self.set_plot_title()
+
     def set_shannon_index(self):
-        si: float = 0.0
-        n: int = self.time_series.__len__()
-        for count in self.time_series.value_counts():
-            # calculate proportion of this integer value in the total population of values
-            p_i = count / n
-            # calculate the Shannon Index (si) given p_i of this value.
-            si += p_i * log10(p_i)
-        si *= -1
-        self.shannon_index = si
+        self.shannon_index = float(shannon_indices(self.store.column(self.store_column).reshape(-1, 1))[0])
 
     def update_static(self):
         if self.shannon_index >= .000001:
@@ -40,4 +89,4 @@ class Signal:
                           " of Arb ID " + hex(int(self.arb_id))
 
     def normalize(self, normalize_strategy):
-        normalize_strategy(self.time_series.values, copy=False)
+        normalize_strategy(self.store.column(self.store_column), copy=False)
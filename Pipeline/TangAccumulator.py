@@ -0,0 +1,58 @@
+from typing import Callable
+from numpy import bitwise_xor, concatenate, float64, ndarray, sum, unpackbits, zeros
+from CanFrames import CanFrames
+
+
+class TangAccumulator:
+    def __init__(self, dlc: int):
+        self.dlc:               int = dlc
+        # Raw (un-normalized) count of how many times each bit flipped between consecutive frames. Bit 0 is the left
+        # hand bit of b0, the same as in the boolean matrix.
+        self.transition_counts: ndarray = zeros(dlc * 8, dtype=float64)
+        self.frame_count:       int = 0
+        # The last payload seen, kept as a one row matrix so the transition into the next update can be counted.
+        self.last_payload:      ndarray = None
+
+    @staticmethod
+    def count_transitions(payload: ndarray, block_rows: int = 1 << 16) -> ndarray:
+        # Count the bit transitions straight from payload bytes (8 bits per byte). A bit flipped between consecutive
+        # frames wherever their payload bytes differ in that bit, so XOR whole bytes first and only unpack the
+        # differences. Working block_rows frames at a time keeps the unpacked bits small no matter the capture length.
+        counts = zeros(payload.shape[1] * 8, dtype=float64)
+        for i in range(0, payload.shape[0] - 1, block_rows):
+            block = payload[i:i + block_rows + 1]
+            counts += sum(unpackbits(bitwise_xor(block[:-1], block[1:]), axis=1), axis=0)
+        return counts
+
+    def update(self, frames: CanFrames):
+        # Add the transitions in frames, which must directly follow (in time) the frames already counted. The
+        # transition between the last frame of the previous update and the first frame of this one is counted too.
+        if frames.__len__() == 0:
+            return
+        payload = frames.payload[:, :self.dlc]
+        if self.last_payload is not None:
+            payload = concatenate((self.last_payload, payload))
+        self.transition_counts += self.count_transitions(payload)
+        self.frame_count += frames.__len__()
+        self.last_payload = payload[-1:].copy()
+
+    def merge(self, other: 'TangAccumulator'):
+        # Combine the counts from a separate capture of the same Arb ID. The two captures weren't recorded back to
+        # back, so no transition is counted between this capture's last frame and the other's first frame. Later
+        # updates continue from the end of the other capture.
+        if other.dlc != self.dlc:
+            raise ValueError("Can't merge TANG accumulators with different DLCs (" + str(self.dlc) + " and " +
+                             str(other.dlc) + ")")
+        self.transition_counts += other.transition_counts
+        self.frame_count += other.frame_count
+        if other.last_payload is not None:
+            self.last_payload = other.last_payload.copy()
+        return self
+
+    def tang(self, normalize_strategy: Callable = None) -> ndarray:
+        # Return a copy of the transition counts normalized with normalize_strategy (e.g. sklearn's minmax_scale).
+        # An all zero TANG is returned as is to avoid divide by zero issues.
+        tang = self.transition_counts.copy()
+        if normalize_strategy is not None and tang.max(initial=0) > 0:
+            normalize_strategy(tang, axis=0, copy=False)
+        return tang
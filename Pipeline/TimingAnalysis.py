@@ -0,0 +1,120 @@
+from numpy import absolute, append, arange, array, bincount, concatenate, cumsum, floor, float64, int64, maximum, \
+    minimum, ones, repeat, rint, sqrt, where, zeros
+from pandas import DataFrame
+from ArbID import ArbID
+
+
+# Percentiles of each Arb ID's transmission intervals reported in ArbID.freq_percentiles
+interval_percentiles:   tuple = (5, 25, 50, 75, 95)
+# Intervals this many times the median interval (or longer) are counted as missed transmission periods.
+missed_period_factor:   float = 1.5
+
+
+def frame_bits(arb_id: int, dlc: int) -> int:
+    # Nominal bits on the wire for one data frame including the 3 bit interframe space, but not stuff bits. Standard
+    # frames have 47 bits of overhead and extended (29 bit ID) frames have 67.
+    return (67 if arb_id > 0x7FF else 47) + 8 * dlc
+
+
+def eligible(arb_id: ArbID) -> bool:
+    # Don't bother with interval statistics if there isn't enough data. You would need to handle a bunch of edge cases.
+    return arb_id.original_data.__len__() >= 4
+
+
+def analyze_bus_timing(id_dictionary:           dict,
+                       time_convert:            int = 1000,
+                       ci_accuracy:             float = 1.645,
+                       synchronous_threshold:   float = 0.1,
+                       bit_rate:                int = 500000) -> DataFrame:
+    # Compute the transmission interval statistics of every Arb ID at once and attach them to each ArbID. The time
+    # stamps of all the Arb IDs are laid end to end so every statistic is a handful of whole-array operations instead of
+    # one pass per Arb ID. Returns one row of timing figures per Arb ID.
+    arb_ids = list(id_dictionary.values())
+    if not arb_ids:
+        return DataFrame()
+    counts = array([arb_id.original_data.__len__() for arb_id in arb_ids], dtype=int64)
+    time = concatenate([arb_id.original_data.time for arb_id in arb_ids])
+    starts = cumsum(counts) - counts
+
+    # Per Arb ID bandwidth (bits per second) and share of the bus, assuming time stamps in seconds. The capture duration
+    # spans every Arb ID.
+    duration = time.max() - time.min()
+    bits = array([frame_bits(arb_id.id, arb_id.dlc) for arb_id in arb_ids], dtype=float64) * counts
+    bandwidth = bits / duration if duration > 0 else zeros(counts.shape[0], dtype=float64)
+    bus_load = bandwidth / bit_rate
+
+    # Drop the 'interval' between the last frame of one Arb ID and the first frame of the next.
+    keep = ones(time.shape[0] - 1, dtype=bool)
+    keep[starts[1:] - 1] = False
+    intervals = (time[1:] - time[:-1])[keep] * time_convert
+    n = counts - 1
+    labels = repeat(arange(arb_ids.__len__()), n)
+    n_safe = maximum(n, 1)
+
+    freq_mean = bincount(labels, intervals, minlength=n.shape[0]) / n_safe
+    deviation = intervals - freq_mean[labels]
+    freq_std = sqrt(bincount(labels, deviation * deviation, minlength=n.shape[0]) / maximum(n - 1, 1))
+
+    # Percentiles use linear interpolation between the closest ranks, the same as numpy.percentile. Sort the intervals
+    # within each Arb ID once and read every percentile of every Arb ID straight out of the sorted array. Each Arb ID's
+    # intervals are already contiguous, so sorting them in place slice by slice is much cheaper than a global lexsort.
+    interval_starts = cumsum(n) - n
+    sorted_intervals = append(intervals, 0.0)
+    for start, stop in zip(interval_starts, interval_starts + n):
+        sorted_intervals[start:stop].sort()
+    last_rank = maximum(n - 1, 0)
+    percentiles = {}
+    for q in interval_percentiles:
+        rank = last_rank * (q / 100)
+        low = floor(rank).astype(int64)
+        high = minimum(low + 1, last_rank)
+        # Arb IDs without any intervals point at the 0.0 appended to the end of sorted_intervals.
+        low = where(n > 0, interval_starts + low, intervals.shape[0])
+        high = where(n > 0, interval_starts + high, intervals.shape[0])
+        percentiles[q] = sorted_intervals[low] + (rank - floor(rank)) * (sorted_intervals[high] - sorted_intervals[low])
+    median = percentiles[50]
+
+    # Jitter is the mean absolute deviation from the median (nominal) interval. An interval at least
+    # missed_period_factor times the median counts as round(interval / median) - 1 missed transmissions.
+    median_safe = where(median > 0, median, 1)[labels]
+    freq_jitter = bincount(labels, absolute(intervals - median[labels]), minlength=n.shape[0]) / n_safe
+    periods = rint(intervals / median_safe) - 1
+    missed = (intervals >= missed_period_factor * median_safe) & (median[labels] > 0)
+    missed_periods = bincount(labels, where(missed, periods, 0), minlength=n.shape[0]).astype(int64)
+
+    for i, arb_id in enumerate(arb_ids):  # type: int, ArbID
+        arb_id.bandwidth = float(bandwidth[i])
+        arb_id.bus_load = float(bus_load[i])
+        if not eligible(arb_id):
+            continue
+        arb_id.ci_sensitivity = ci_accuracy
+        arb_id.freq_mean = float(freq_mean[i])
+        arb_id.freq_std = float(freq_std[i])
+        # Assumes distribution of freq_intervals is gaussian normal.
+        mean_offset = ci_accuracy * arb_id.freq_std / sqrt(n[i])
+        arb_id.freq_ci = (arb_id.freq_mean - mean_offset, arb_id.freq_mean + mean_offset)
+        arb_id.freq_percentiles = {q: float(percentiles[q][i]) for q in interval_percentiles}
+        arb_id.freq_jitter = float(freq_jitter[i])
+        arb_id.missed_periods = int(missed_periods[i])
+        # mean_to_ci_ratio is the ratio of the CI range to the mean value. This is to provide heuristic to determine
+        # if this Arb ID can be called 'synchronous' given the time scale of its average transmission frequency.
+        # For example, imagine an Arb ID transmitting with a mean frequency of exactly one second. Its 90% Confidence
+        # Interval spans 50 milliseconds about that ideal mean. It's reasonable to assume this Arb ID was engineered to
+        # be a 'synchronous' signal. However, a different Arb ID with a mean frequency of 40 milliseconds and the same
+        # confidence interval could not be reasonably assumed to have been engineered to be 'synchronous'. This other
+        # Arb ID was engineered to be 'high frequency' compared to the first example, but there isn't evidence that it's
+        # intended to be a high frequency 'synchronous' process that adheres to a certain clock frequency.
+        # This inference relies upon the assumption that the OEM didn't engineer the bus to be a train wreck with some
+        # IDs losing an arbitrarily large percentage of their arbitration phases.
+        arb_id.mean_to_ci_ratio = 2*mean_offset/arb_id.freq_mean
+        if arb_id.mean_to_ci_ratio <= synchronous_threshold:
+            arb_id.synchronous = True
+
+    return DataFrame({'frames': counts,
+                      'freq_mean': freq_mean,
+                      'freq_std': freq_std,
+                      'freq_jitter': freq_jitter,
+                      'missed_periods': missed_periods,
+                      'bandwidth': bandwidth,
+                      'bus_load': bus_load},
+                     index=[arb_id.id for arb_id in arb_ids])
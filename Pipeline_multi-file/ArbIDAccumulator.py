@@ -0,0 +1,75 @@
+from numpy import empty, float64, full, inf, ndarray, uint8, uint32
+from CanFrames import CanFrames
+from TangAccumulator import TangAccumulator
+
+
+class ArbIDAccumulator:
+    def __init__(self, arb_id: int):
+        self.id:                int = arb_id
+        # These features are updated for every chunk of frames fed to update()
+        self.frame_count:       int = 0
+        self.dlc:               int = None
+        self.consistent_dlc:    bool = True
+        # Transition counts are only trustworthy if the time stamps arrive strictly increasing. Otherwise the frames
+        # have to be de-duplicated and sorted first and the TANG is rebuilt from the complete boolean matrix.
+        self.in_order:          bool = True
+        self.last_time:         float = -inf
+        self.tang:              TangAccumulator = None
+        # The time stamps and payload bytes (trimmed to the DLC) of every frame seen so far. Their first frame_count
+        # rows are filled; the arrays double in length when they run out of room, so frames() never has to join chunks.
+        self.time:              ndarray = None
+        self.payload:           ndarray = None
+
+    def update(self, frames: CanFrames):
+        self.frame_count += frames.__len__()
+        if self.dlc is None:
+            self.dlc = int(frames.dlc[0])
+        if self.consistent_dlc and (frames.dlc != self.dlc).any():
+            # generate_arb_id_dictionary ignores Arb IDs that don't always use the same DLC. There's no reason to keep
+            # holding on to this one's payloads.
+            self.consistent_dlc = False
+            self.time = None
+            self.payload = None
+            self.tang = None
+        if not self.consistent_dlc:
+            return
+
+        time = frames.time
+        first = self.frame_count - frames.__len__()
+        if self.time is None or self.time.shape[0] < self.frame_count:
+            self.grow(max(self.frame_count, 2 * (0 if self.time is None else self.time.shape[0])))
+        self.time[first:self.frame_count] = time
+        self.payload[first:self.frame_count] = frames.payload[:, :self.dlc]
+
+        if self.in_order:
+            self.in_order = bool(time[0] > self.last_time and (time[1:] > time[:-1]).all())
+            self.last_time = time[-1]
+        # Count the bit transitions in this chunk, including the one between the last frame of the previous chunk and
+        # the first frame of this one.
+        if self.tang is None:
+            self.tang = TangAccumulator(self.dlc)
+        self.tang.update(frames)
+
+    def grow(self, capacity: int):
+        # Move the frames seen so far into arrays with room for capacity frames.
+        time = empty(capacity, dtype=float64)
+        payload = empty((capacity, self.dlc), dtype=uint8)
+        if self.time is not None:
+            filled = self.time.shape[0]
+            time[:filled] = self.time
+            payload[:filled] = self.payload
+        self.time = time
+        self.payload = payload
+
+    def frames(self) -> CanFrames:
+        # Return every frame seen so far as one contiguous CanFrames. The payload is already trimmed to the DLC. The
+        # accumulator's arrays are trimmed to frame_count in place (no copy) and handed over as they are.
+        if self.time is not None:
+            if self.time.shape[0] > self.frame_count:
+                self.time.resize(self.frame_count, refcheck=False)
+                self.payload.resize((self.frame_count, self.dlc), refcheck=False)
+            time, payload = self.time, self.payload
+        else:
+            time, payload = empty(0, dtype=float64), empty((0, self.dlc or 0), dtype=uint8)
+        n = time.shape[0]
+        return CanFrames(time, full(n, self.id, dtype=uint32), full(n, self.dlc or 0, dtype=uint8), payload)
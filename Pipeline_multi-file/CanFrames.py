@@ -0,0 +1,29 @@
+from typing import List
+from numpy import concatenate, empty, float64, ndarray, uint8, uint32
+
+
+class CanFrames:
+    # A batch of CAN frames stored column-wise. The payload is one contiguous (frames x bytes) uint8 matrix instead of
+    # a wide integer column per byte. That is 8 bytes of storage per 8 byte payload. Row i of every array describes
+    # the same frame. Indexing a CanFrames with a slice, boolean mask or integer array returns the matching frames.
+    def __init__(self, time: ndarray, arb_id: ndarray, dlc: ndarray, payload: ndarray):
+        self.time:      ndarray = time      # float64 seconds
+        self.id:        ndarray = arb_id    # uint32 Arbitration ID
+        self.dlc:       ndarray = dlc       # uint8 data length code
+        self.payload:   ndarray = payload   # uint8 payload bytes, one row per frame
+
+    def __len__(self) -> int:
+        return self.time.shape[0]
+
+    def __getitem__(self, rows) -> 'CanFrames':
+        return CanFrames(self.time[rows], self.id[rows], self.dlc[rows], self.payload[rows])
+
+    @staticmethod
+    def concatenate(frames_list: List['CanFrames'], width: int = 8) -> 'CanFrames':
+        if not frames_list:
+            return CanFrames(empty(0, dtype=float64), empty(0, dtype=uint32), empty(0, dtype=uint8),
+                             empty((0, width), dtype=uint8))
+        return CanFrames(concatenate([f.time for f in frames_list]),
+                         concatenate([f.id for f in frames_list]),
+                         concatenate([f.dlc for f in frames_list]),
+                         concatenate([f.payload for f in frames_list]))
@@ -0,0 +1,82 @@
+from numpy import bincount, cumsum, flatnonzero, full, inf, int64, log10, ndarray, unpackbits, zeros
+from typing import List
+from ArbID import ArbID
+
+
+def range_shannon_indices(bits: ndarray) -> ndarray:
+    # Return a bits x bits matrix where cell [i, j] is the Shannon index of bit positions i through j (inclusive) read
+    # as one unsigned integer. Cells below the diagonal are 0. This is the cache of range entropies the partition
+    # solver works from: bits * (bits + 1) / 2 entropy evaluations, each one pass over the rows.
+    n, bit_width = bits.shape
+    shannon = zeros((bit_width, bit_width))
+    if n == 0:
+        return shannon
+    for i in range(bit_width):
+        # Label each row by the value of bits i through j. Extending the range by bit j + 1 splits each label in two.
+        # The labels are renumbered densely after each bit, so they stay below n and can be counted with bincount
+        # instead of sorted.
+        labels = zeros(n, dtype=int64)
+        label_count = 1
+        for j in range(i, bit_width):
+            keys = labels * 2 + bits[:, j]
+            counts = bincount(keys, minlength=2 * label_count)
+            present = counts > 0
+            p_i = counts[present] / n
+            shannon[i, j] = -(p_i * log10(p_i)).sum()
+            label_count = p_i.size
+            if label_count == n:
+                # Every row already has its own value; wider ranges can't change the Shannon index.
+                shannon[i, j + 1:] = shannon[i, j]
+                break
+            labels = (cumsum(present) - 1)[keys]
+    return shannon
+
+
+def entropy_partition(bits: ndarray,
+                      token_penalty:    float = 0.0,
+                      include_padding:  bool = False) -> (List[tuple], List[int]):
+    # Split the bit positions into contiguous (start, stop) tokens that maximize the total Shannon index of the tokens
+    # less token_penalty per token, by dynamic programming over the cached range entropies. Splitting a token never
+    # lowers the total Shannon index, so without a penalty single bit tokens are always optimal; the penalty is what
+    # makes wider tokens worthwhile. Ties go to the wider token. Constant bits are padding and aren't part of any token
+    # unless include_padding is True. Returns the tokens and the padding bit positions like get_composition_just_tang.
+    shannon = range_shannon_indices(bits)
+    bit_width = shannon.shape[0]
+    is_padding = shannon.diagonal() <= 0.000001
+
+    # best[j] is the best total for bit positions 0 through j - 1 and token_start[j] is where the last token covering
+    # bit j - 1 starts, or -1 if bit j - 1 is left out as padding.
+    best = zeros(bit_width + 1)
+    token_start = full(bit_width + 1, -1, dtype=int64)
+    first_allowed_start = 0
+    for j in range(1, bit_width + 1):
+        if not include_padding and is_padding[j - 1]:
+            best[j] = best[j - 1]
+            first_allowed_start = j
+            continue
+        totals = full(j, -inf)
+        totals[first_allowed_start:] = best[first_allowed_start:j] + shannon[first_allowed_start:j, j - 1] - \
+            token_penalty
+        token_start[j] = totals.argmax()
+        best[j] = totals[token_start[j]]
+
+    tokens: List[tuple] = []
+    j = bit_width
+    while j > 0:
+        if token_start[j] < 0:
+            j -= 1
+        else:
+            tokens.append((int(token_start[j]), j - 1))
+            j = int(token_start[j])
+    tokens.reverse()
+    return tokens, flatnonzero(is_padding).tolist()
+
+
+def get_entropy_composition(arb_id: ArbID, include_padding: bool = False, token_penalty: float = 0.0):
+    # An alternative to LexicalAnalysis.get_composition that tokenizes with entropy_partition instead of the TANG.
+    if arb_id.boolean_matrix is None:
+        # This Arb ID was generated with pack_bits. Unpack the payload bytes.
+        bits = unpackbits(arb_id.original_data.payload[:, :arb_id.dlc], axis=1)
+    else:
+        bits = arb_id.boolean_matrix
+    arb_id.tokenization, arb_id.padding = entropy_partition(bits, token_penalty, include_padding)
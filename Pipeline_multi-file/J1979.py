@@ -1,22 +1,27 @@
-from pandas import DataFrame, Series
-from numpy import dtype
+from pandas import DataFrame, Index, Series
+from numpy import dtype, int64
+from CanFrames import CanFrames
 
 
 class J1979:
-    def __init__(self, pid: int,  original_data: DataFrame, pid_dict: DataFrame):
+    __slots__ = ('pid', 'title', 'data')
+
+    def __init__(self, pid: int,  original_data: CanFrames, pid_dict: DataFrame):
         self.pid:   int = pid
         self.title: str = pid_dict.at[pid, 'title']
         self.data:  Series = self.process_response_data(original_data, pid_dict)
         print("Found " + str(self.data.shape[0]) + " responses for J1979 PID " + str(hex(self.pid)) + ":", self.title)
 
-    def process_response_data(self, original_data, pid_dict) -> Series:
-        A = original_data['b3']
-        B = original_data['b4']
-        C = original_data['b5']
-        D = original_data['b6']
+    def process_response_data(self, original_data: CanFrames, pid_dict) -> Series:
+        # The formulas do signed arithmetic on the payload bytes. Widen them from uint8 first.
+        time = Index(original_data.time, name='time')
+        A = Series(original_data.payload[:, 3].astype(int64), index=time)
+        B = Series(original_data.payload[:, 4].astype(int64), index=time)
+        C = Series(original_data.payload[:, 5].astype(int64), index=time)
+        D = Series(original_data.payload[:, 6].astype(int64), index=time)
         try:
             return Series(data=pid_dict.at[self.pid, 'formula'](A,B,C,D),
-                          index=original_data.index,
+                          index=time,
                           name=self.title,
                           dtype=dtype(pid_dict.at[self.pid, 'formula'](A,B,C,D)))
         except:
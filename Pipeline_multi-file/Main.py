@@ -15,6 +15,7 @@ for key, sample_list in samples.items():  # type: tuple, list
         id_dict, j1979_dict, pid_dict = sample.pre_process()
         if j1979_dict:
             sample.plot_j1979(j1979_dict, vehicle_number=str(current_vehicle_number))
+        sample.plot_windowed_tangs(id_dict, vehicle_number=str(current_vehicle_number))
 
         # The following 3-lines of code were intended to find good settings for TANG inversions.... it didn't work?
         # print("\nFinding optimal lexical analysis threshold parameters for " + sample.output_vehicle_dir)
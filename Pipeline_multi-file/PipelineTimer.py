@@ -19,6 +19,7 @@ class PipelineTimer:
         self.bool_matrix_to_tang:   List[float] = []
         self.plot_save_j1979_dict:  float = 0.0
         self.plot_save_j1979_pid:   List[float] = []
+        self.plot_save_windowed_tang: float = 0.0
 
         # Lexical Analysis Timings
         self.tokenization:          float = 0.0
@@ -89,6 +90,12 @@ class PipelineTimer:
     def set_plot_save_j1979_pid(self):
         self.plot_save_j1979_pid.append(time() - self.iteration_time)
 
+    # Called in the Plotter.py plot_windowed_tangs function.
+    def set_plot_save_windowed_tang(self):
+        self.plot_save_windowed_tang = time() - self.function_time
+        if self.verbose:
+            print("\n" + str(self.plot_save_windowed_tang) + " seconds to plot and save the windowed TANGs by Arb ID")
+
     #               Lexical Analysis Timings                #
 
     # Called in the LexicalAnalysis.py tokenize_dictionary function.
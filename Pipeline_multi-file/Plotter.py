@@ -15,6 +15,7 @@ figure_transp:  bool = False
 arb_id_folder:  str = 'figures'
 cluster_folder: str = 'clusters'
 j1979_folder:   str = 'j1979'
+windowed_tang_folder: str = 'windowed_tangs'
 threshold_folder: str = 'threshold_heatmaps'
 
 
@@ -102,6 +103,63 @@ def plot_signals_by_arb_id(a_timer: PipelineTimer, arb_id_dict: dict, signal_dic
     a_timer.set_plot_save_arb_id_dict()
 
 
+def plot_windowed_tangs(a_timer: PipelineTimer, arb_id_dict: dict, window: float, by_time: bool, vehicle_number: str,
+                        force: bool=False):
+    if path.exists(windowed_tang_folder):
+        if force:
+            rmtree(windowed_tang_folder)
+        else:
+            print("\nWindowed TANG plotting appears to have already been done and forcing is turned off. Skipping...")
+            return
+
+    a_timer.start_function_time()
+
+    for k_id, arb_id in arb_id_dict.items():
+        if arb_id.static or arb_id.short:
+            continue
+        print("Plotting windowed TANGs for Arb ID " + str(k_id) + " (" + str(hex(k_id)) + ") for Vehicle " +
+              vehicle_number)
+
+        # One column per window and one row per bit position so drift in a bit's transition frequency reads left to
+        # right across the capture.
+        window_starts, tangs = arb_id.windowed_tang(window, by_time)
+        fig, ax = plt.subplots()
+        fig.set_size_inches(8, 1 + tangs.shape[1] * 0.06)
+        if by_time:
+            x_extent = (window_starts[0], window_starts[-1] + window)
+        else:
+            x_extent = (0, arb_id.original_data.__len__())
+        im = ax.imshow(tangs.T, cmap='inferno', interpolation='none', aspect='auto', vmin=0.0, vmax=1.0,
+                       extent=(x_extent[0], x_extent[1], tangs.shape[1], 0))
+        cbar = ax.figure.colorbar(im, ax=ax)
+        cbar.ax.set_ylabel("Transition Frequency", rotation=-90, va="bottom")
+        ax.set_title("Windowed TANG for Arbitration ID " + hex(k_id) + " from Vehicle " + vehicle_number + "\n(" +
+                     str(window) + (" second" if by_time else " frame") + " windows)",
+                     weight='bold')
+        ax.set_xlabel("Time" if by_time else "Frame")
+        ax.set_ylabel("Bit Position")
+        fig.tight_layout()
+
+        if not path.exists(windowed_tang_folder):
+            mkdir(windowed_tang_folder)
+        chdir(windowed_tang_folder)
+
+        # If you want transparent backgrounds, a different file format, etc. then change these settings accordingly.
+        savefig(hex(arb_id.id) + "." + figure_format,
+                bbox_inches='tight',
+                pad_inches=0.0,
+                dpi=figure_dpi,
+                format=figure_format,
+                transparent=figure_transp)
+
+        chdir("..")
+
+        plt.close(fig)
+        print("\tComplete...")
+
+    a_timer.set_plot_save_windowed_tang()
+
+
 def plot_signals_by_cluster(a_timer: PipelineTimer,
                             cluster_dict: dict,
                             signal_dict: dict,
@@ -1,11 +1,16 @@
-from pandas import DataFrame, read_csv, Series
-from numpy import int64
+from pandas import DataFrame, read_csv
+from numpy import add, argsort, cumsum, flatnonzero, isnan, lexsort, maximum, minimum, ndarray, ones, sort, split, \
+    unique, zeros
 from os import path, remove, getcwd
 from pickle import load
 from typing import Callable
 from ArbID import ArbID
+from ArbIDAccumulator import ArbIDAccumulator
+from CanFrames import CanFrames
 from J1979 import J1979
+from LogParser import iter_log, read_log
 from PipelineTimer import PipelineTimer
+from TimingAnalysis import analyze_bus_timing
 
 
 class PreProcessor:
@@ -13,52 +18,31 @@ class PreProcessor:
         self.data_filename:         str = data_filename
         self.id_output_filename:    str = id_output_filename
         self.j1979_output_filename: str = j1979_output_filename
-        self.data:                  DataFrame = None
+        self.data:                  CanFrames = None
         self.import_time:           float = 0.0
         self.dictionary_time:       float = 0.0
         self.total_time:            float = 0.0
         self.use_j1979:             bool = use_j1979
 
     def import_csv(self, a_timer: PipelineTimer, filename):
-
-        def hex2int(x):
-            if x == '':
-                return 0
-            return int(x, 16)
-
-        def fix_time(x):
-            try:
-                return float(str(x)[:-1])
-            except ValueError:
-                # There may have been a newline the capture device was trying to write when turned off.
-                return None
-
-        # Used by pd.read_csv to apply the functions to the respective column vectors in the .csv file
-        convert_dict = {'time': fix_time, 'id': hex2int, 'dlc': hex2int, 'b0': hex2int, 'b1': hex2int, 'b2': hex2int,
-                        'b3': hex2int, 'b4': hex2int, 'b5': hex2int, 'b6': hex2int, 'b7': hex2int}
-
         print("\nReading in " + self.data_filename + "...")
 
         a_timer.start_function_time()
 
-        self.data = read_csv(filename,
-                             header=None,
-                             names=['time', 'id', 'dlc', 'b0', 'b1', 'b2', 'b3', 'b4', 'b5', 'b6', 'b7'],
-                             skiprows=7,
-                             delimiter='\t',
-                             converters=convert_dict,
-                             index_col=0)
+        # read_log decodes the hex fields and time stamps column-wise straight into native dtypes. This replaces the
+        # per-cell hex2int and fix_time converters that read_csv used to call on every field of every frame.
+        self.data = read_log(filename, skip_rows=7, delimiter='\t')
 
         a_timer.set_can_csv_to_df()
 
         # sanity check output of the original data
         # print("\nSample of the original data:")
-        # print(self.data.head(5), "\n")
+        # print(self.data.payload[:5], "\n")
 
     def import_pid_dict(self, filename):
         # print("\nSample of the original data:")
 
-        # print(self.data.head(5), "\n")
+        # print(self.data.payload[:5], "\n")
         def pid(x):
             return int(x)
 
@@ -83,12 +67,12 @@ class PreProcessor:
                         index_col=0)
 
     @staticmethod
-    def generate_j1979_dictionary(j1979_data: DataFrame, pid_dict: DataFrame) -> dict:
+    def generate_j1979_dictionary(j1979_data: CanFrames, pid_dict: DataFrame) -> dict:
 
         d = {}
-        services = j1979_data.groupby('b2')
-        for uds_pid, data in services:
-            d[uds_pid] = J1979(uds_pid, data, pid_dict)
+        services = j1979_data.payload[:, 2]
+        for uds_pid in unique(services):
+            d[int(uds_pid)] = J1979(int(uds_pid), j1979_data[services == uds_pid], pid_dict)
         return d
 
     def generate_arb_id_dictionary(self,
@@ -98,7 +82,10 @@ class PreProcessor:
                                    time_conversion:             int = 1000,
                                    freq_analysis_accuracy:      float = 0.0,
                                    freq_synchronous_threshold:  float = 0.0,
-                                   force:                       bool = False) -> (dict, dict):
+                                   force:                       bool = False,
+                                   block_size:                  int = 0,
+                                   pack_bits:                   bool = False,
+                                   bit_rate:                    int = 500000) -> (dict, dict):
         id_dictionary = {}
         j1979_dictionary = {}
 
@@ -108,7 +95,6 @@ class PreProcessor:
                 remove(self.id_output_filename)
             if path.isfile(self.j1979_output_filename):
                 remove(self.j1979_output_filename)
-            self.import_csv(a_timer, self.data_filename)
         elif path.isfile(self.id_output_filename):
             # This logic assumes that there will be a J1979 dict if and only if there is an Arb ID dict
             print("\tLoading Arb ID dictionary from pickled data: " + getcwd() + "\\" + self.id_output_filename)
@@ -118,62 +104,177 @@ class PreProcessor:
                 j1979_dictionary = load(open(self.j1979_output_filename, "rb"))
             print("\tSet 'force_pre_processing' in Sample.py to True to re-compute instead...")
             return id_dictionary, j1979_dictionary
-        else:
-            self.import_csv(a_timer, self.data_filename)
+
+        if block_size:
+            # Don't hold the whole log in memory. See stream_arb_id_dictionary.
+            return self.stream_arb_id_dictionary(a_timer, normalize_strategy, pid_dict, time_conversion,
+                                                 freq_analysis_accuracy, freq_synchronous_threshold, block_size,
+                                                 pack_bits, bit_rate)
+        self.import_csv(a_timer, self.data_filename)
 
         a_timer.start_function_time()
 
-        for arb_id in Series.unique(self.data['id']):
-            if isinstance(arb_id, int64):
+        # Partition the frames by Arb ID once. Each Arb ID gets a contiguous slice of the partitioned frames that is
+        # already de-duplicated and sorted by time. The slices are visited in order of each Arb ID's first appearance.
+        frames, starts, stops, consistent_dlc = self.partition_by_arb_id(self.data)
+        for start, stop, consistent in zip(starts, stops, consistent_dlc):
+            arb_id = frames.id[start]
+            if arb_id == 2015:
+                # This is the J1979 requests (if any) (ID 0x7DF = 2015). Just ignore it.
+                continue
+            elif arb_id == 2024 and self.use_j1979:
+                # This is the J1979 responses (ID 0x7DF & 0x8 = 0x7E8 = 2024)
+                # Every response is kept in logged order, including any with a repeated time stamp.
+                j1979_data = self.data[self.data.id == arb_id]
+                a_timer.start_nested_function_time()
+                j1979_dictionary = self.generate_j1979_dictionary(j1979_data, pid_dict)
+                a_timer.set_j1979_creation()
+            elif arb_id > 0:
+                # Check if the Arbitration ID always used the same DLC. If not, ignore it.
+                # We can effectively ignore this Arb ID by not adding it to the Arb ID dictionary.
+                if not consistent:
+                    continue
+                a_timer.start_iteration_time()
+
+                this_id = ArbID(arb_id)
+                this_id.original_data = frames[start:stop]
+                this_id.dlc = int(this_id.original_data.dlc[0])
+
+                # If DLC < 8, we can automatically drop payload bytes > DLC.
+                # E.G. drop bytes "B7" and "B6" if DLC is 6; those are padding data injected by can-dump and were
+                # not actually on the bus.
+                this_id.original_data.payload = this_id.original_data.payload[:, :this_id.dlc]
+
+                this_id.generate_binary_matrix_and_tang(a_timer, normalize_strategy, pack_bits=pack_bits)
+                id_dictionary[arb_id] = this_id
+
+                a_timer.set_arb_id_creation()
+
+        # Transmission frequency analysis is done for every Arb ID at once. See TimingAnalysis.py
+        analyze_bus_timing(id_dictionary, time_conversion, freq_analysis_accuracy, freq_synchronous_threshold, bit_rate)
+
+        a_timer.set_raw_df_to_arb_id_dict()
+
+        return id_dictionary, j1979_dictionary
+
+    @staticmethod
+    def partition_by_arb_id(frames: CanFrames) -> (CanFrames, ndarray, ndarray, ndarray):
+        # Group every Arb ID's frames into one contiguous slice with a single sort instead of masking the whole log once
+        # per Arb ID. Each slice is sorted by time and frames that repeat a time stamp of the same Arb ID are dropped,
+        # keeping the first logged frame.
+        # Returns the partitioned frames plus the start, stop and DLC consistency of each Arb ID's slice, listed in
+        # order of each Arb ID's first appearance in the log.
+        n = frames.__len__()
+        if n == 0:
+            return frames, zeros(0, dtype=int), zeros(0, dtype=int), zeros(0, dtype=bool)
+        # lexsort is stable. Equal time stamps of an Arb ID stay in logged order, so the first logged one comes first.
+        order = lexsort((frames.time, frames.id))
+        arb_ids = frames.id[order]
+        time = frames.time[order]
+        dlc = frames.dlc[order]
+
+        new_id = ones(n, dtype=bool)
+        new_id[1:] = arb_ids[1:] != arb_ids[:-1]
+        id_starts = flatnonzero(new_id)
+        # The DLC check and first appearance consider every frame, including those about to be dropped.
+        consistent_dlc = minimum.reduceat(dlc, id_starts) == maximum.reduceat(dlc, id_starts)
+        first_seen = minimum.reduceat(order, id_starts)
+
+        duplicate = zeros(n, dtype=bool)
+        duplicate[1:] = ~new_id[1:] & ((time[1:] == time[:-1]) | (isnan(time[1:]) & isnan(time[:-1])))
+
+        kept_counts = add.reduceat(~duplicate, id_starts, dtype=int)
+        stops = cumsum(kept_counts)
+        starts = stops - kept_counts
+        visit = argsort(first_seen)
+        return frames[order[~duplicate]], starts[visit], stops[visit], consistent_dlc[visit]
+
+    @staticmethod
+    def drop_duplicate_times(frames: CanFrames) -> CanFrames:
+        # Drop every frame whose time stamp was already seen earlier in the log while preserving the logged order.
+        first_seen = unique(frames.time, return_index=True)[1]
+        if first_seen.shape[0] == frames.__len__():
+            return frames
+        return frames[sort(first_seen)]
+
+    @staticmethod
+    def sort_by_time(frames: CanFrames) -> CanFrames:
+        if (frames.time[1:] >= frames.time[:-1]).all():
+            return frames
+        return frames[argsort(frames.time, kind='stable')]
+
+    def stream_arb_id_dictionary(self,
+                                 a_timer:                       PipelineTimer,
+                                 normalize_strategy:            Callable,
+                                 pid_dict:                      DataFrame,
+                                 time_conversion:               int = 1000,
+                                 freq_analysis_accuracy:        float = 0.0,
+                                 freq_synchronous_threshold:    float = 0.0,
+                                 block_size:                    int = 1 << 24,
+                                 pack_bits:                     bool = False,
+                                 bit_rate:                      int = 500000) -> (dict, dict):
+        # Build the same dictionaries as generate_arb_id_dictionary without ever materializing self.data. The log is
+        # parsed block_size bytes at a time and each block's frames are handed to a per Arb ID accumulator. Memory still
+        # grows with the number of frames: every Arb ID keeps the time stamp and DLC trimmed payload bytes of each of
+        # its frames (its boolean matrix is built from them), but the log's text and DataFrame are never held whole.
+        print("\nStreaming " + self.data_filename + " in blocks of " + str(block_size) + " bytes...")
+
+        a_timer.start_function_time()
+
+        accumulators = {}
+        j1979_chunks = []
+
+        for frames in iter_log(self.data_filename, skip_rows=7, delimiter='\t', block_size=block_size):
+            # Group this block's frames by Arb ID. The stable sort keeps each Arb ID's frames in logged order. Visit
+            # the groups in order of first appearance so the dictionary is ordered like the in-memory version.
+            order = argsort(frames.id, kind='stable')
+            sorted_ids = frames.id[order]
+            groups = split(order, flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1)
+            for rows in sorted(groups, key=lambda g: g[0]):
+                arb_id = int(frames.id[rows[0]])
                 if arb_id == 2015:
                     # This is the J1979 requests (if any) (ID 0x7DF = 2015). Just ignore it.
                     continue
                 elif arb_id == 2024 and self.use_j1979:
                     # This is the J1979 responses (ID 0x7DF & 0x8 = 0x7E8 = 2024)
-                    j1979_data = self.data.loc[self.data['id'] == arb_id].copy()
-                    j1979_data.drop('dlc', axis=1, inplace=True)
-                    j1979_data.drop('id', axis=1, inplace=True)
-                    a_timer.start_nested_function_time()
-                    j1979_dictionary = self.generate_j1979_dictionary(j1979_data, pid_dict)
-                    a_timer.set_j1979_creation()
+                    j1979_chunks.append(frames[rows])
                 elif arb_id > 0:
-                    a_timer.start_iteration_time()
-
-                    this_id = ArbID(arb_id)
-                    this_id.original_data = self.data.loc[self.data['id'] == arb_id]
-                    this_id.original_data = this_id.original_data.copy()  # type: DataFrame
-
-                    # Check if the Arbitration ID always used the same DLC. If not, ignore it.
-                    # We can effectively ignore this Arb ID by not adding it to the Arb ID dictionary.
-                    if this_id.original_data['dlc'].nunique() is not 1:
-                        continue
-                    this_id.dlc = this_id.original_data['dlc'].iloc[0]
-                    this_id.original_data.drop('dlc', axis=1, inplace=True)
-                    this_id.original_data.drop('id', axis=1, inplace=True)
-
-                    # If DLC < 8, we can automatically drop data column vectors > DLC.
-                    # E.G. drop bytes "B7" and "B6" if DLC is 6; those are padding data injected by can-dump and were
-                    # not actually on the bus.
-                    if this_id.dlc < 8:
-                        for i in range(this_id.dlc, 8):
-                            this_id.original_data.drop('b' + str(i), axis=1, inplace=True)
-
-                    # Check if there are duplicate index values and correct them.
-                    if not this_id.original_data.index.is_unique:
-                        correction_mask = this_id.original_data.index.duplicated()
-                        this_id.original_data = this_id.original_data[~correction_mask]
-
-                    # Check for non-monotonic values and sort them to be monotonic
-                    if not this_id.original_data.index.is_monotonic:
-                        this_id.original_data.sort_index(inplace=True)
-
-                    this_id.generate_binary_matrix_and_tang(a_timer, normalize_strategy)
-                    this_id.analyze_transmission_frequency(time_convert=time_conversion,
-                                                           ci_accuracy=freq_analysis_accuracy,
-                                                           synchronous_threshold=freq_synchronous_threshold)
-                    id_dictionary[arb_id] = this_id
-
-                    a_timer.set_arb_id_creation()
+                    if arb_id not in accumulators:
+                        accumulators[arb_id] = ArbIDAccumulator(arb_id)
+                    accumulators[arb_id].update(frames[rows])
+
+        id_dictionary = {}
+        j1979_dictionary = {}
+
+        if j1979_chunks:
+            a_timer.start_nested_function_time()
+            j1979_dictionary = self.generate_j1979_dictionary(CanFrames.concatenate(j1979_chunks), pid_dict)
+            a_timer.set_j1979_creation()
+
+        for arb_id in list(accumulators.keys()):
+            # Pop each accumulator as it's consumed so its payload chunks can be freed.
+            accumulator = accumulators.pop(arb_id)  # type: ArbIDAccumulator
+            # Check if the Arbitration ID always used the same DLC. If not, ignore it.
+            if not accumulator.consistent_dlc:
+                continue
+            a_timer.start_iteration_time()
+
+            this_id = ArbID(arb_id)
+            this_id.dlc = accumulator.dlc
+            # Check if there are duplicate time stamps and correct them. Keep the first frame at each time.
+            # Then check for non-monotonic time stamps and sort them to be monotonic.
+            this_id.original_data = self.sort_by_time(self.drop_duplicate_times(accumulator.frames()))
+
+            # The streamed TANG accumulator stands in for the TANG as long as no frames had to be dropped or reordered.
+            this_id.generate_binary_matrix_and_tang(a_timer, normalize_strategy,
+                                                    accumulator.tang if accumulator.in_order else None,
+                                                    pack_bits)
+            id_dictionary[arb_id] = this_id
+
+            a_timer.set_arb_id_creation()
+
+        # Transmission frequency analysis is done for every Arb ID at once. See TimingAnalysis.py
+        analyze_bus_timing(id_dictionary, time_conversion, freq_analysis_accuracy, freq_synchronous_threshold, bit_rate)
 
         a_timer.set_raw_df_to_arb_id_dict()
 
@@ -2,7 +2,8 @@ from PreProcessor import PreProcessor
 from Validator import Validator
 from LexicalAnalysis import tokenize_dictionary, generate_signals
 from SemanticAnalysis import generate_correlation_matrix, signal_clustering, j1979_signal_labeling
-from Plotter import plot_j1979, plot_signals_by_arb_id, plot_signals_by_cluster, plot_dendrogram
+from Plotter import plot_j1979, plot_signals_by_arb_id, plot_signals_by_cluster, plot_dendrogram, \
+    plot_windowed_tangs
 from sklearn.preprocessing import minmax_scale
 from typing import Callable
 from PipelineTimer import PipelineTimer
@@ -25,6 +26,8 @@ pickle_linkage_filename:    str = 'pickleLinkage.p'
 pickle_combined_df_filename: str = 'pickleCombinedDataFrame.p'
 csv_all_signals_filename:   str = 'complete_correlation_matrix.csv'
 pickle_timer_filename:      str = 'pickleTimer.p'
+memmap_corr_matrix_filename: str = 'memmapCorrelationMatrix.dat'
+pickle_corr_graph_filename: str = 'pickleCorrelationGraph.p'
 
 dump_to_pickle:             bool = True
 
@@ -42,6 +45,7 @@ use_j1979:                  bool = True
 force_lexical_analysis:     bool = False
 force_signal_generation:    bool = False
 force_arb_id_plotting:      bool = True
+force_windowed_tang_plotting: bool = False
 
 force_correlation_matrix:   bool = False
 force_clustering:           bool = False
@@ -55,16 +59,52 @@ time_conversion = 1000  # convert seconds to milliseconds
 z_lookup = {.8: 1.28, .9: 1.645, .95: 1.96, .98: 2.33, .99: 2.58}
 freq_analysis_accuracy = z_lookup[0.9]
 freq_synchronous_threshold = 0.1
+# Nominal bit rate of the captured bus in bits per second. Used to estimate each Arb ID's share of the bus load.
+bus_bit_rate:               int = 500000
+# Set to a block size in bytes (e.g. 1 << 24) to read the log in that many bytes at a time instead of importing it
+# whole. The log's text and DataFrame are never held whole, but memory still grows with the number of frames since each
+# Arb ID keeps its frames' time stamps and payload bytes. 0 imports the whole log.
+streaming_block_size:       int = 0
+# Set to True to keep each Arb ID's bits packed 8 per byte instead of building its boolean matrix (one byte per bit).
+# This cuts memory and the pickled Arb ID dictionary by up to 8x for long captures.
+pack_boolean_matrix:        bool = False
+# Set to a window length to plot each Arb ID's TANG over consecutive windows of the capture as a heatmap. The window is
+# in seconds, or in frames if tang_window_by_time is False. 0 turns windowed TANG plotting off.
+tang_window:                float = 0.0
+tang_window_by_time:        bool = True
+# Number of worker processes used by the lexical analysis threshold search. 0 uses every core.
+threshold_search_workers:   int = 1
+# Set to True to search a coarse threshold grid and refine around its best cells instead of scoring every threshold
+# pair.
+adaptive_threshold_search:  bool = False
 
 # Threshold parameters used during lexical analysis.
 tokenization_bit_distance:  float = 0.2
 tokenize_padding:           bool = True
 merge_tokens:               bool = True
+# Set to True to tokenize each Arb ID by the partition of its bits that maximizes the total Shannon index of the tokens
+# less entropy_token_penalty per token, instead of by its TANG.
+use_entropy_tokenization:   bool = False
+entropy_token_penalty:      float = 0.1
 
 # Threshold parameters used during semantic analysis
 subset_selection_size:      float = 0.25
 max_intra_cluster_distance: float = 0.20
 min_j1979_correlation:      float = 0.85
+# Set to True to write the correlation matrix of all signals to memmap_corr_matrix_filename block by block instead of
+# holding it in memory. Use this for tens of thousands of signals. The memmap file takes the place of the .csv file and
+# clustering only reads the pairs with correlation of at least sparse_correlation_floor from it (see below).
+out_of_core_correlation:    bool = False
+# Set to True to keep just the signal pairs with correlation of at least sparse_correlation_floor, as a sparse
+# correlation graph, instead of the dense correlation matrix. Use this for tens of thousands of signals. Clustering
+# gives the same clusters as long as the floor is below 1 - max_intra_cluster_distance; lower floors only fill in more
+# of the top of the dendrogram.
+sparse_correlation:         bool = False
+sparse_correlation_floor:   float = 0.5
+
+# A sparse correlation graph is pickled in place of the dense correlation matrix .csv file.
+corr_matrix_filename:       str = pickle_corr_graph_filename if sparse_correlation else \
+    memmap_corr_matrix_filename if out_of_core_correlation else csv_corr_matrix_filename
 # fuzzy_labeling:             bool = True
 
 
@@ -93,7 +133,8 @@ class Sample:
         # Semantic analysis settings
         self.max_inter_cluster_dist:    float = max_intra_cluster_distance
         # Various comparison testing methods are implemented in the Validator class
-        self.validator:                 Validator = Validator(use_j1979, kfold_n)
+        self.validator:                 Validator = Validator(use_j1979, kfold_n, threshold_search_workers,
+                                                               adaptive_threshold_search)
 
     def make_and_move_to_vehicle_directory(self):
         # This drills down three directories to './output/make_model_year/sample_index/' Make directories as needed
@@ -126,7 +167,10 @@ class Sample:
                                                                                    time_conversion,
                                                                                    freq_analysis_accuracy,
                                                                                    freq_synchronous_threshold,
-                                                                                   force_pre_processing)
+                                                                                   force_pre_processing,
+                                                                                   streaming_block_size,
+                                                                                   pack_boolean_matrix,
+                                                                                   bus_bit_rate)
         if dump_to_pickle:
             if force_pre_processing:
                 if path.isfile(pickle_arb_id_filename):
@@ -182,7 +226,8 @@ class Sample:
         if force_lexical_analysis or not path.isfile(pickle_arb_id_filename):
             tokenize_dictionary(a_timer=a_timer, d=id_dictionary, force=force_lexical_analysis,
                                 include_padding=self.use_padding, merge=self.merge_tokens,
-                                max_distance=self.tang_inversion_bit_dist)
+                                max_distance=self.tang_inversion_bit_dist, use_entropy=use_entropy_tokenization,
+                                token_penalty=entropy_token_penalty)
         if dump_to_pickle:
             self.make_and_move_to_vehicle_directory()
             if force_lexical_analysis:
@@ -219,20 +264,41 @@ class Sample:
                                force=force_arb_id_plotting)
         self.move_back_to_parent_directory()
 
+    def plot_windowed_tangs(self, id_dictionary: dict, vehicle_number: str):
+        if not tang_window:
+            return
+        self.make_and_move_to_vehicle_directory()
+        plot_windowed_tangs(a_timer=a_timer,
+                            arb_id_dict=id_dictionary,
+                            window=tang_window,
+                            by_time=tang_window_by_time,
+                            vehicle_number=vehicle_number,
+                            force=force_windowed_tang_plotting)
+        self.move_back_to_parent_directory()
+
     def generate_correlation_matrix(self, signal_dictionary: dict):
         self.make_and_move_to_vehicle_directory()
         if dump_to_pickle and force_correlation_matrix:
-            if path.isfile(csv_corr_matrix_filename):
-                remove(csv_corr_matrix_filename)
+            if path.isfile(corr_matrix_filename):
+                remove(corr_matrix_filename)
         corr_matrix, combined_df = generate_correlation_matrix(a_timer=a_timer,
-                                                               csv_signals_correlation_filename=csv_corr_matrix_filename,
+                                                               csv_signals_correlation_filename=corr_matrix_filename,
                                                                combined_df_filename=pickle_combined_df_filename,
                                                                signal_dict=signal_dictionary,
-                                                               force=force_correlation_matrix)
-        if not path.isfile(csv_corr_matrix_filename) and not corr_matrix.empty:
+                                                               force=force_correlation_matrix,
+                                                               memmap_filename=memmap_corr_matrix_filename
+                                                               if out_of_core_correlation else '',
+                                                               sparse=sparse_correlation,
+                                                               min_coefficient=sparse_correlation_floor)
+        if not path.isfile(corr_matrix_filename) and sparse_correlation:
+            print("\nDumping correlation graph for " + self.output_vehicle_dir + " to " + corr_matrix_filename)
+            dump(corr_matrix, open(corr_matrix_filename, "wb"))
+            print("\tComplete...")
+        elif not path.isfile(corr_matrix_filename) and not corr_matrix.empty and not out_of_core_correlation:
+            # An out of core matrix was already written to corr_matrix_filename, its memmap file, block by block.
             print("\nDumping subset correlation matrix for " + self.output_vehicle_dir + " to " +
-                  csv_corr_matrix_filename)
-            corr_matrix.to_csv(csv_corr_matrix_filename)
+                  corr_matrix_filename)
+            corr_matrix.to_csv(corr_matrix_filename)
             print("\tComplete...")
         if not path.isfile(pickle_combined_df_filename) and not combined_df.empty:
             print("\nDumping combined signal DataFrame matrix for " + self.output_vehicle_dir + " to " +
@@ -242,13 +308,15 @@ class Sample:
         self.move_back_to_parent_directory()
         return corr_matrix, combined_df
 
-    def cluster_signals(self, corr_matrix: DataFrame):
+    def cluster_signals(self, corr_matrix):
         self.make_and_move_to_vehicle_directory()
         cluster_dict, linkage_matrix = signal_clustering(corr_matrix,
                                                          self.max_inter_cluster_dist,
                                                          pickle_clusters_filename,
                                                          pickle_linkage_filename,
-                                                         force_clustering)  # type: dict, ndarray
+                                                         force_clustering,
+                                                         sparse_correlation_floor if out_of_core_correlation
+                                                         else 0.0)  # type: dict, ndarray
         # Before we return or save the clusters, lets remove all singleton clusters. This serves as an implicit
         # filtering technique for incorrectly tokenized signals.
         list_to_remove = []
@@ -0,0 +1,54 @@
+from numpy import empty, float32, ix_, maximum, minimum, ndarray, searchsorted, where
+from pandas import DataFrame, Index, Series
+
+
+class SignalStore:
+    # All the signals of one Arb ID stored column-wise: a (frames x signals) float32 value matrix and the one array of
+    # time stamps they share. The matrix is column major, so each signal's values are contiguous and a Signal is just
+    # a column number in a store. Pickling a signal dictionary writes each store once, however many Signals use it.
+    def __init__(self, time: ndarray, values: ndarray):
+        self.time:      ndarray = time                                  # float64 seconds
+        self.values:    ndarray = values.astype(float32, order='F')     # float32, one column per signal
+
+    def __len__(self) -> int:
+        return self.time.shape[0]
+
+    def column(self, i: int) -> ndarray:
+        # A view (not a copy) of signal i's values.
+        return self.values[:, i]
+
+    def series(self, i: int) -> Series:
+        # Signal i as a pandas Series indexed by time. The Series wraps the store's arrays without copying them.
+        return Series(self.values[:, i], index=Index(self.time, name='time', copy=False), copy=False)
+
+
+def nearest_indexer(source: ndarray, target: ndarray) -> ndarray:
+    # Return the position in the sorted time stamps source nearest to each time stamp in target. Ties go to the later
+    # source time stamp, the same as pandas' reindex(method='nearest').
+    after = searchsorted(source, target, side='left')
+    later = minimum(after, source.shape[0] - 1)
+    earlier = maximum(after - 1, 0)
+    use_earlier = (after == source.shape[0]) | ((after > 0) & (target - source[earlier] < source[later] - target))
+    return where(use_earlier, earlier, later)
+
+
+def align_signals(signals: dict) -> DataFrame:
+    # Return a float32 DataFrame with one column per signal (keyed like signals) and every signal re-indexed by nearest
+    # time stamp to the time stamps of the signal with the most samples. Signals in the same SignalStore share their
+    # time stamps, so the nearest time stamp search runs once per store and its signals are gathered with one take.
+    largest_store = None
+    columns_by_store = {}
+    for i, signal in enumerate(signals.values()):
+        if largest_store is None or signal.store.__len__() > largest_store.__len__():
+            largest_store = signal.store
+        columns_by_store.setdefault(id(signal.store), (signal.store, [], []))
+        columns_by_store[id(signal.store)][1].append(i)
+        columns_by_store[id(signal.store)][2].append(signal.store_column)
+    if largest_store is None:
+        return DataFrame()
+
+    aligned = empty((largest_store.__len__(), signals.__len__()), dtype=float32)
+    for store, df_columns, store_columns in columns_by_store.values():
+        rows = nearest_indexer(store.time, largest_store.time)
+        aligned[:, df_columns] = store.values[ix_(rows, store_columns)]
+    return DataFrame(aligned, columns=list(signals.keys()), index=Index(largest_store.time, name='time'))
@@ -1,12 +1,21 @@
-from LexicalAnalysis import get_composition_just_tang, merge_tokens_just_composition
-from sklearn.model_selection import KFold
+from LexicalAnalysis import tokenize_tangs, tokenize_threshold_grid, token_borders
 from ArbID import ArbID
-from numpy import arange, ndarray, zeros, float16, add, divide, argmax, unravel_index
+from numpy import arange, ndarray, zeros, float16, add, divide, argmax, unravel_index, count_nonzero, vstack, append, \
+    argsort, isnan, ix_, nan, nan_to_num, bitwise_xor, concatenate, cumsum, float64, full, int64, maximum, minimum, \
+    unique, unpackbits
+from typing import List
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from time import perf_counter
 
 
 # Threshold parameters used during tokenization.
 tokenization_bit_distance:  float = 0.2
 tokenize_padding:           bool = True
+# Adaptive lex threshold search parameters. The coarse grid scores every coarse_search_step-th threshold, then the full
+# resolution grid is scored within one coarse step of the best coarse_search_regions coarse cells.
+coarse_search_step:         int = 10
+coarse_search_regions:      int = 3
 
 
 def alignment_score(mismatch: int, bit_width: int):
@@ -15,60 +24,70 @@ def alignment_score(mismatch: int, bit_width: int):
     return float16(1 - mismatch / (bit_width - 1))
 
 
-def borders(token: tuple, last_index: int):
-    if not token[0] == 0:
-        if not token[1] == last_index:
-            return [token[0]-1, token[1]]
-        else:
-            return [token[0]-1]
-    else:
-        if not token[1] == last_index:
-            return [token[1]]
-    return []
-
-
 def train_test_alignment_score(tang_a: ndarray, tang_b: ndarray, max_inversion: float, max_merge: float):
-    # Note: padding is used as a dummy variable to maintain compatibility with the primary pipeline get_composition()
-    comp_a, padding = get_composition_just_tang(tang_a, include_padding=True, max_inversion_distance=max_inversion)
-    comp_a = merge_tokens_just_composition(tokens=comp_a, this_tang=tang_a, max_distance=max_merge)
-    comp_b, padding = get_composition_just_tang(tang_b, include_padding=True, max_inversion_distance=max_inversion)
-    comp_b = merge_tokens_just_composition(tokens=comp_b, this_tang=tang_b, max_distance=max_merge)
-
-    bit_width = len(tang_a)
-    id_a_borders = []
-    id_b_borders = []
-
-    for token in comp_a:
-        # print("\nToken:", token)
-        # result = borders(token, bit_width-1)
-        # print("\tBorders:", result)
-        id_a_borders.extend(borders(token, bit_width-1))
-    for token in comp_b:
-        # print("\nToken:", token)
-        # result = borders(token, bit_width - 1)
-        # print("\tBorders:", result)
-        id_b_borders.extend(borders(token, bit_width-1))
-
-    id_a_borders = set(id_a_borders)
-    id_b_borders = set(id_b_borders)
+    # Tokenize both TANGs in one call. A border is the last bit position before the start of a new token.
+    starts, members = tokenize_tangs(vstack((tang_a, tang_b)), include_padding=True,
+                                     max_inversion_distance=max_inversion, max_merge_distance=max_merge)
+    id_borders = token_borders(starts, members)
     # Mismatch set is the symmetric difference: borders where there was a border in only one of the two payloads.
-    mismatch_set = id_a_borders.union(id_b_borders) - id_a_borders.intersection(id_b_borders)
-
-    return alignment_score(len(mismatch_set), bit_width)
+    mismatch = count_nonzero(id_borders[0] != id_borders[1])
+
+    return alignment_score(mismatch, len(tang_a))
+
+
+def fold_tangs(arb_id: ArbID, fold_n: int) -> List[tuple]:
+    # Return a (train TANG, test TANG) pair for each of fold_n contiguous folds; the same folds as sklearn's KFold
+    # without shuffling. Transitions are cumulatively summed once at the fold edges, so no fold's frames are copied.
+    # The train frames are read as one capture, the same as the TANG of payload[train], so the transition from the
+    # frame before the test fold to the frame after it is counted.
+    payload = arb_id.original_data.payload[:, :arb_id.dlc]
+    n = payload.shape[0]
+    fold_sizes = full(fold_n, n // fold_n, dtype=int64)
+    fold_sizes[:n % fold_n] += 1
+    edges = append(0, cumsum(fold_sizes))
+    first = edges[:-1]
+    last = edges[1:] - 1
+    before = maximum(first - 1, 0)
+    after = minimum(last + 1, n - 1)
+
+    cumulative = arb_id.cumulative_transitions(concatenate((first, last, before, after, [n - 1])))
+    first_count, last_count, before_count, after_count = cumulative[:-1].reshape(4, fold_n, -1)
+    test_tangs = last_count - first_count
+    train_tangs = cumulative[-1] - (after_count - before_count)
+    joined = (first > 0) & (last < n - 1)
+    train_tangs[joined] += unpackbits(bitwise_xor(payload[before[joined]], payload[after[joined]]), axis=1)
+    return list(zip(train_tangs.astype(float64), test_tangs.astype(float64)))
+
+
+def fold_score_matrix(fold: tuple, inversion_values: ndarray, merge_values: ndarray) -> ndarray:
+    # Score one (train TANG, test TANG) fold for every pair of inversion and merge thresholds. Both TANGs are tokenized
+    # for the whole threshold grid at once and all the pairs are scored together. This is a module level function so
+    # it can be sent to worker processes.
+    train_tang, test_tang = fold
+    train_borders = token_borders(*tokenize_threshold_grid(train_tang, True, inversion_values, merge_values))
+    test_borders = token_borders(*tokenize_threshold_grid(test_tang, True, inversion_values, merge_values))
+    return alignment_score(count_nonzero(train_borders != test_borders, axis=2), len(train_tang))
 
 
 class Validator:
     def __init__(self,
-                 use_j1979:     bool = False,
-                 fold_n:        int = 5):
-        self.use_j1979:     bool = use_j1979
-        self.fold_n:        int = fold_n
+                 use_j1979:         bool = False,
+                 fold_n:            int = 5,
+                 workers:           int = 1,
+                 adaptive_search:   bool = False):
+        self.use_j1979:         bool = use_j1979
+        self.fold_n:            int = fold_n
+        # Number of worker processes for the lex threshold search. 0 uses every core.
+        self.workers:           int = workers
+        # Score a coarse threshold grid and refine around its best cells instead of scoring the full grid.
+        self.adaptive_search:   bool = adaptive_search
 
     @staticmethod
     # This function allows for pickling just the score matrix and re-creating a Sample object using it later.
     def set_lex_threshold_parameters(sample):
         if sample.avg_score_matrix.shape[0] > 1:
-            optimal_setting = argmax(sample.avg_score_matrix)
+            # Cells an adaptive search never scored are NaN. Rank them below every real score.
+            optimal_setting = argmax(nan_to_num(sample.avg_score_matrix, nan=-1.0))
             optimal_setting = unravel_index(optimal_setting, sample.avg_score_matrix.shape)
             sample.optimal_bit_dist = optimal_setting[0]
             sample.optimal_merge_dist = optimal_setting[1]
@@ -78,28 +97,89 @@ class Validator:
     def k_fold_lex_threshold_selection(self, id_dict: dict, sample):
         list_of_inversion_values = arange(0, 1.01, 0.01)
         list_of_merge_values = arange(0, 1.01, 0.01)
-        sample.avg_score_matrix = zeros((len(list_of_inversion_values), len(list_of_merge_values)), dtype=float16)
-        number_of_ids_scored: int = 0
 
+        # Fold TANGs are one pass over each Arb ID's payloads, so build them all here. Only the TANGs, not the Arb IDs
+        # and their payloads, are then sent to the worker processes for the much slower threshold grid scoring.
+        id_fold_tangs = []
         for id_label, arb_id in id_dict.items():  # type: int, ArbID
             if arb_id.static or arb_id.short:
                 continue
-            this_id_avg_score_matrix = zeros((len(list_of_inversion_values), len(list_of_merge_values)), dtype=float16)
-
-            print("\tID:", id_label, "\tnumber of observed payloads:", arb_id.original_data.shape[0])
-
-            kf = KFold(n_splits=self.fold_n)
-            for k, (train, test) in enumerate(kf.split(arb_id.boolean_matrix)):
-                score_matrix = zeros((len(list_of_inversion_values), len(list_of_merge_values)), dtype=float16)
-                train_tang = arb_id.generate_tang(boolean_matrix=arb_id.boolean_matrix[train])
-                test_tang = arb_id.generate_tang(boolean_matrix=arb_id.boolean_matrix[test])
+            print("\tID:", id_label, "\tnumber of observed payloads:", arb_id.original_data.__len__())
+            id_fold_tangs.extend(fold_tangs(arb_id, self.fold_n))
+
+        # One pool of worker processes serves every scoring call of the search.
+        workers = self.workers if self.workers > 0 else cpu_count()
+        pool = Pool(workers) if workers > 1 and id_fold_tangs.__len__() > 1 else None
+        try:
+            if self.adaptive_search:
+                sample.avg_score_matrix = self.adaptive_score_thresholds(id_fold_tangs, list_of_inversion_values,
+                                                                         list_of_merge_values, pool)
+            else:
+                sample.avg_score_matrix = self.score_thresholds(id_fold_tangs, list_of_inversion_values,
+                                                                list_of_merge_values, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.set_lex_threshold_parameters(sample)
 
-                for m, i in enumerate(list_of_inversion_values):
-                    for n, j in enumerate(list_of_merge_values):
-                        score_matrix[m, n] = train_test_alignment_score(train_tang, test_tang, i, j)
+    def adaptive_score_thresholds(self,
+                                  id_fold_tangs:    list,
+                                  inversion_values: ndarray,
+                                  merge_values:     ndarray,
+                                  pool:             Pool = None) -> ndarray:
+        # Score a coarse grid, then the full resolution grid around the best coarse_search_regions coarse cells. The
+        # refinement windows are scored together in one call, as the grid of every inversion and every merge threshold
+        # in any window. Scores only depend on their own cell's thresholds, so every scored cell has the same value an
+        # exhaustive search would give it. Cells that were never scored are left as NaN.
+        start_time = perf_counter()
+        score_matrix = full((len(inversion_values), len(merge_values)), nan, dtype=float16)
+        coarse_inversions = arange(0, len(inversion_values), coarse_search_step)
+        coarse_merges = arange(0, len(merge_values), coarse_search_step)
+        score_matrix[ix_(coarse_inversions, coarse_merges)] = self.score_thresholds(
+            id_fold_tangs, inversion_values[coarse_inversions], merge_values[coarse_merges], pool)
+
+        coarse_scores = score_matrix[ix_(coarse_inversions, coarse_merges)]
+        best_cells = argsort(-coarse_scores, axis=None, kind='stable')[:coarse_search_regions]
+        fine_inversions, fine_merges = [], []
+        for m, n in zip(*unravel_index(best_cells, coarse_scores.shape)):
+            fine_inversions.append(arange(max(coarse_inversions[m] - coarse_search_step, 0),
+                                          min(coarse_inversions[m] + coarse_search_step + 1, len(inversion_values))))
+            fine_merges.append(arange(max(coarse_merges[n] - coarse_search_step, 0),
+                                      min(coarse_merges[n] + coarse_search_step + 1, len(merge_values))))
+        fine_inversions = unique(concatenate(fine_inversions))
+        fine_merges = unique(concatenate(fine_merges))
+        score_matrix[ix_(fine_inversions, fine_merges)] = self.score_thresholds(
+            id_fold_tangs, inversion_values[fine_inversions], merge_values[fine_merges], pool)
+
+        print("\tAdaptive threshold search scored", count_nonzero(~isnan(score_matrix)), "of", score_matrix.size,
+              "threshold pairs in", round(perf_counter() - start_time, 2), "seconds.")
+        return score_matrix
+
+    def score_thresholds(self,
+                         id_fold_tangs:     list,
+                         inversion_values:  ndarray,
+                         merge_values:      ndarray,
+                         pool:              Pool = None) -> ndarray:
+        # Return the alignment score of every pair of inversion_values and merge_values averaged over the folds of each
+        # Arb ID, then over the Arb IDs. id_fold_tangs holds fold_n consecutive (train TANG, test TANG) pairs per Arb
+        # ID. The folds are scored by pool's worker processes if a pool is given.
+        score_fold = partial(fold_score_matrix, inversion_values=inversion_values, merge_values=merge_values)
+        if pool is None:
+            fold_score_matrices = list(map(score_fold, id_fold_tangs))
+        else:
+            # Pool.map returns the score matrices in submission order, so the reduction below adds them up in the same
+            # order (and with the same float16 rounding) no matter how many workers there are.
+            workers = self.workers if self.workers > 0 else cpu_count()
+            fold_score_matrices = pool.map(score_fold, id_fold_tangs,
+                                           chunksize=max(1, id_fold_tangs.__len__() // (4 * workers)))
+
+        avg_score_matrix = zeros((len(inversion_values), len(merge_values)), dtype=float16)
+        number_of_ids_scored: int = id_fold_tangs.__len__() // self.fold_n
+        for i in range(number_of_ids_scored):
+            this_id_avg_score_matrix = zeros((len(inversion_values), len(merge_values)), dtype=float16)
+            for score_matrix in fold_score_matrices[i * self.fold_n:(i + 1) * self.fold_n]:
                 this_id_avg_score_matrix = add(this_id_avg_score_matrix, score_matrix)
             this_id_avg_score_matrix = divide(this_id_avg_score_matrix, self.fold_n)
-            sample.avg_score_matrix = add(sample.avg_score_matrix, this_id_avg_score_matrix)
-            number_of_ids_scored += 1
-        sample.avg_score_matrix = divide(sample.avg_score_matrix, number_of_ids_scored)
-        self.set_lex_threshold_parameters(sample)
+            avg_score_matrix = add(avg_score_matrix, this_id_avg_score_matrix)
+        return divide(avg_score_matrix, number_of_ids_scored)
@@ -1,47 +1,29 @@
-from numpy import arange, ndarray, zeros, concatenate, uint64
-from math import log10
+from numpy import arange, ndarray, concatenate, left_shift, uint8, uint64, unpackbits
 from pandas import Series, concat
+from Signal import shannon_indices
+from EntropyPartition import entropy_partition
 
 
 def shannon_index(X: Series):
-    H: float = 0.0
-    n: int = X.shape[0]
-    for count in X.value_counts():
-        # calculate proportion of this integer value in the total population of values
-        p_i = count / n
-        # calculate the Shannon Index (H) given p_i of this value.
-        H += p_i * log10(p_i)
-    H *= -1
-    return H
+    return float(shannon_indices(X.to_numpy().reshape(-1, 1))[0])
 
 
 def make_binary_matrix(X: Series):
-    boolean_matrix = zeros((X.shape[0], 8), dtype=uint64)
-    for i, row in enumerate(X.iteritems()):
-        if row[1] > 0:
-            # i is the row in the boolean_matrix
-            # j*8 is the left hand bit for this byte in the payload
-            # j*8 + 8 is the right hand bit for this byte in the payload
-            # e.g. byte index 1 starts at bits 1*8 = 8 to 1*8+8 = 16; [8:16]
-            # likewise, byte index 7 starts at bits 7*8 = 56 to 7*8+8 = 64
-            # Numpy indexing is non-inclusive of the upper bound. So [0:8] is the first 8 elements
-            bin_string = format(row[1], '08b')
-            boolean_matrix[i, :] = [x == '1' for x in bin_string]
-    return boolean_matrix
+    # One uint8 per bit, most significant bit first. e.g. 5 becomes [0, 0, 0, 0, 0, 1, 0, 1]
+    return unpackbits(X.to_numpy(dtype=uint8).reshape(-1, 1), axis=1)
 
 
 def binary_to_int(X: ndarray, tokens: list):
     signals = {}
     for token in tokens:
-        # Convert the binary ndarray to a list of string representations of each row
-        temp1 = [''.join(str(x) for x in row) for row in X[:, token[0]:token[1] + 1]]
-        temp2 = zeros((temp1.__len__(), 1), dtype=uint64)
-        # convert each string representation to int
-        for i, row in enumerate(temp1):
-            temp2[i] = int(row, 2)
+        # Weight each bit of the token by its place value, most significant bit first, and sum each row. Integer
+        # weights keep the result exact for tokens up to 64 bits wide.
+        width = token[1] - token[0] + 1
+        weights = left_shift(uint64(1), arange(width - 1, -1, -1, dtype=uint64))
+        temp2 = X[:, token[0]:token[1] + 1].astype(uint64) @ weights
 
         # create an unsigned integer pandas.Series using the time index from this Arb ID's original data.
-        signal = Series(temp2[:, 0])
+        signal = Series(temp2)
         signals[token] = signal
     return signals
 
@@ -79,3 +61,6 @@ while cutoff < upper:
 
 for k, v in sum_shannon.items():
     print(k, v)
+
+# The best partition of the bits into any number of contiguous tokens, not just one cutoff.
+print(entropy_partition(x12_bin, token_penalty=0.1, include_padding=True))
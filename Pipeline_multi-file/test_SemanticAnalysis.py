@@ -0,0 +1,65 @@
+from numpy import array_equal, clip, fill_diagonal, sort
+from numpy.random import RandomState
+from pandas import DataFrame
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.spatial.distance import squareform
+from Correlation import correlation_graph, pearson_correlation
+from SemanticAnalysis import signal_clustering
+
+
+def synthetic_signals() -> DataFrame:
+    # Groups of noisy copies of a few random walks plus some independent noise, so there are clusters at several
+    # distances.
+    random = RandomState(0)
+    walks = random.normal(size=(500, 4)).cumsum(axis=0)
+    columns = {}
+    for i in range(24):
+        noise = random.normal(size=500)
+        columns[(i, 0, 7)] = noise if i % 6 == 5 else walks[:, i % 4] + (1 + i % 3) * noise
+    return DataFrame(columns)
+
+
+def scipy_clusters(corr_matrix: DataFrame, threshold: float):
+    distances = 1 - corr_matrix.where(corr_matrix > 0, 0).values
+    fill_diagonal(distances, 0.0)
+    Z = linkage(clip(squareform(distances, checks=False), 0, None), method='single')
+    return Z, fcluster(Z, t=threshold, criterion='distance')
+
+
+def partition(labels, signal_ids) -> set:
+    clusters = {}
+    for signal_id, label in zip(signal_ids, labels):
+        clusters.setdefault(label, set()).add(signal_id)
+    return set(frozenset(cluster) for cluster in clusters.values())
+
+
+def test_signal_clustering_matches_scipy_single_linkage():
+    corr_matrix = synthetic_signals().corr()
+    for threshold in (0.1, 0.3, 0.6, 0.9):
+        cluster_dict, Z = signal_clustering(corr_matrix.copy(), threshold)
+        scipy_Z, scipy_labels = scipy_clusters(corr_matrix, threshold)
+
+        assert set(frozenset(cluster) for cluster in cluster_dict.values()) == \
+            partition(scipy_labels, corr_matrix.index)
+        assert array_equal(sort(Z[:, 2]).round(6), sort(scipy_Z[:, 2]).round(6))
+        # Clusters are numbered 1, 2, ... in order of their first signal.
+        assert list(cluster_dict.keys()) == list(range(1, cluster_dict.__len__() + 1))
+        first_signals = [cluster[0] for cluster in cluster_dict.values()]
+        assert first_signals == sorted(first_signals, key=list(corr_matrix.index).index)
+
+
+def test_signal_clustering_of_correlation_graph_matches_dense_matrix():
+    df = synthetic_signals()
+    threshold = 0.6
+    dense_clusters, _ = signal_clustering(df.corr(), threshold)
+    graph_clusters, _ = signal_clustering(correlation_graph(df, 1 - threshold - 0.01), threshold)
+    assert dense_clusters == graph_clusters
+
+
+def test_signal_clustering_of_memmapped_matrix_matches_in_memory_matrix(tmp_path):
+    df = synthetic_signals()
+    threshold = 0.6
+    in_memory_clusters, _ = signal_clustering(pearson_correlation(df), threshold)
+    memmapped = pearson_correlation(df, block_size=5, memmap_filename=str(tmp_path / 'corr.dat'))
+    memmapped_clusters, _ = signal_clustering(memmapped, threshold, min_coefficient=0.5)
+    assert in_memory_clusters == memmapped_clusters
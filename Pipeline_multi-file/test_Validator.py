@@ -0,0 +1,56 @@
+from numpy import arange, array_equal, float64, full, isnan, uint8, uint32, zeros
+from numpy.random import RandomState
+from ArbID import ArbID
+from CanFrames import CanFrames
+from Validator import Validator
+
+
+class ScoreSample:
+    # Just the Sample attributes Validator sets.
+    def __init__(self):
+        self.avg_score_matrix = None
+        self.optimal_bit_dist = None
+        self.optimal_merge_dist = None
+        self.output_vehicle_dir = ''
+
+
+def synthetic_id_dict() -> dict:
+    # Arb IDs with a counter, a slow signal and some noisy bits, so the threshold grid has more than one score.
+    random = RandomState(0)
+    id_dict = {}
+    for arb_id_label in range(3):
+        n = 400 + 50 * arb_id_label
+        payload = zeros((n, 8), dtype=uint8)
+        payload[:, 0] = arange(n) % 256
+        payload[:, 1] = (arange(n) // (7 + arb_id_label)) % 256
+        payload[:, 2] = random.randint(0, 4, n)
+        payload[:, 3 + arb_id_label] = random.randint(0, 256, n)
+        arb_id = ArbID(arb_id_label)
+        arb_id.dlc = 8
+        arb_id.original_data = CanFrames(arange(n, dtype=float64) / 100, full(n, arb_id_label, dtype=uint32),
+                                         full(n, 8, dtype=uint8), payload)
+        arb_id.static = False
+        arb_id.short = False
+        id_dict[arb_id_label] = arb_id
+    return id_dict
+
+
+def test_adaptive_search_matches_exhaustive_search():
+    id_dict = synthetic_id_dict()
+    exhaustive, adaptive = ScoreSample(), ScoreSample()
+    Validator(fold_n=3).k_fold_lex_threshold_selection(id_dict, exhaustive)
+    Validator(fold_n=3, adaptive_search=True).k_fold_lex_threshold_selection(id_dict, adaptive)
+
+    scored = ~isnan(adaptive.avg_score_matrix)
+    assert 0 < scored.sum() < scored.size
+    assert array_equal(adaptive.avg_score_matrix[scored], exhaustive.avg_score_matrix[scored])
+    assert (adaptive.optimal_bit_dist, adaptive.optimal_merge_dist) == \
+        (exhaustive.optimal_bit_dist, exhaustive.optimal_merge_dist)
+
+
+def test_worker_pool_matches_serial_scoring():
+    id_dict = synthetic_id_dict()
+    serial, pooled = ScoreSample(), ScoreSample()
+    Validator(fold_n=3, adaptive_search=True).k_fold_lex_threshold_selection(id_dict, serial)
+    Validator(fold_n=3, workers=2, adaptive_search=True).k_fold_lex_threshold_selection(id_dict, pooled)
+    assert array_equal(serial.avg_score_matrix, pooled.avg_score_matrix, equal_nan=True)